@@ -1,33 +1,398 @@
+import asyncio
+import json
+import logging
 import os
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Union
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
+from starlette.requests import ClientDisconnect
+from src.metrics import SIZE_BUCKETS, metrics
+from src.micro_batcher import MicroBatcher
 from src.normalize import InverseTextNormalizer
+from src.streaming import StreamSession, normalize_lines, read_lines
+from src.worker_pool import PoolFull, WorkerPool
+
+logger = logging.getLogger("uvicorn.error")
+
+inverse_normalizer = InverseTextNormalizer(
+    bundle_dir=os.environ.get("VIET_ITN_BUNDLE"),
+    cache_size=int(os.environ.get("VIET_ITN_CACHE_SIZE", 0)),
+    cache_bytes=int(os.environ.get("VIET_ITN_CACHE_BYTES", 0)),
+    cache_ttl=float(os.environ.get("VIET_ITN_CACHE_TTL", 0)) or None,
+    localize_spans=os.environ.get("VIET_ITN_LOCALIZE_SPANS", "0") == "1",
+    max_chunk_words=int(os.environ.get("VIET_ITN_MAX_CHUNK_WORDS", 0)),
+    engine=os.environ.get("VIET_ITN_ENGINE", "pipeline"),
+    token_cache_size=int(os.environ.get("VIET_ITN_TOKEN_CACHE_SIZE", 0))
+)
+# normalization runs on worker threads or processes, never on the event loop
+pool = WorkerPool(
+    inverse_normalizer,
+    workers=int(os.environ.get("VIET_ITN_WORKERS", 1)),
+    max_queue=int(os.environ.get("VIET_ITN_MAX_QUEUE", 64)),
+    kind=os.environ.get("VIET_ITN_POOL", "process"),
+)
+# process workers do not cache, results are looked up and stored here so all workers share one cache
+parent_cache = inverse_normalizer.result_cache if pool.kind == "process" else None
+# opt-in: concurrent /normalize requests are coalesced into batches of up to
+# VIET_ITN_MICROBATCH_SIZE texts, waiting at most VIET_ITN_MICROBATCH_DELAY_MS
+microbatch_delay = float(os.environ.get("VIET_ITN_MICROBATCH_DELAY_MS", 0)) / 1000
+batcher = None
+if microbatch_delay > 0:
+    batcher = MicroBatcher(
+        pool,
+        max_size=int(os.environ.get("VIET_ITN_MICROBATCH_SIZE", 32)),
+        max_delay=microbatch_delay,
+        cache=parent_cache,
+    )
+# keys of parent_cache being normalized, concurrent requests for a key await the same future (single-flight)
+in_flight: Dict[str, asyncio.Future] = {}
+# running flights, referenced so they are not garbage collected
+flight_tasks = set()
+# texts of a /normalize/stream request in flight at the same time, reading the body pauses beyond that
+stream_window = int(os.environ.get("VIET_ITN_STREAM_WINDOW", 0)) or 2 * pool.workers
+# limits of a single /normalize/batch request
+max_batch_size = int(os.environ.get("VIET_ITN_MAX_BATCH_SIZE", 256))
+max_batch_bytes = int(os.environ.get("VIET_ITN_MAX_BATCH_BYTES", 1 << 20))
+grammar_version = inverse_normalizer.grammar_version()
+reload_lock = asyncio.Lock()
+
+
+async def reload_grammars():
+    global grammar_version
+    async with reload_lock:
+        try:
+            version = await asyncio.to_thread(inverse_normalizer.grammar_version)
+            compile_seconds, swap_seconds = await asyncio.to_thread(inverse_normalizer.reload)
+        except Exception:
+            metrics.inc("viet_itn_reload_failures_total")
+            logger.exception("Grammar reload failed, keeping the current grammars")
+            raise
+        if pool.kind == "process":
+            await asyncio.to_thread(pool.restart)
+        grammar_version = version
+        metrics.inc("viet_itn_reload_total")
+        metrics.observe("viet_itn_reload_compile_seconds", compile_seconds)
+        metrics.observe("viet_itn_reload_swap_seconds", swap_seconds)
+        logger.info(f"Grammars reloaded: compiled in {compile_seconds:.3f}s, swapped in {swap_seconds * 1000:.3f}ms")
+        return {"grammar_version": version, "compile_seconds": compile_seconds, "swap_seconds": swap_seconds}
+
+
+async def watch_grammars(interval: float):
+    # version of sources that failed to reload, retried only once the sources change again
+    failed_version = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            version = await asyncio.to_thread(inverse_normalizer.grammar_version)
+        except Exception:
+            logger.exception("Failed to read the grammar version")
+            continue
+        if version in (grammar_version, failed_version) or reload_lock.locked():
+            continue
+        logger.info("Grammar sources changed, reloading")
+        try:
+            await reload_grammars()
+        except Exception:
+            # logged by reload_grammars
+            failed_version = version
+        else:
+            failed_version = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    interval = float(os.environ.get("VIET_ITN_WATCH_INTERVAL", 0))
+    watcher = asyncio.create_task(watch_grammars(interval)) if interval > 0 else None
+    yield
+    if watcher:
+        watcher.cancel()
+    pool.shutdown()
+
 
 app = FastAPI(
     title="Vietnamese Text Normalization API",
     description="API to perform inverse text normalization for Vietnamese.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-inverse_normalizer = InverseTextNormalizer()
-
 class NormalizationRequest(BaseModel):
     text: str = Field(..., example="ngày ba mươi tháng tư năm một chín bảy năm", description="Text to normalize")
 
 class NormalizationResponse(BaseModel):
     normalized_text: str
 
+def queue_full(e: PoolFull) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"Server is busy: {e}", headers={"Retry-After": "1"})
+
+def start_flights(keys: List[str]):
+    """Normalizes `keys` on the pool in a task of its own, each awaited through its future in `in_flight`."""
+    loop = asyncio.get_running_loop()
+    futures = {key: loop.create_future() for key in keys}
+    for future in futures.values():
+        # a caller that went away leaves the exception unretrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    in_flight.update(futures)
+    task = asyncio.create_task(run_flights(futures))
+    flight_tasks.add(task)
+    task.add_done_callback(flight_tasks.discard)
+
+async def run_flights(futures: Dict[str, asyncio.Future]):
+    keys = list(futures)
+    generation = parent_cache.generation
+    slice_size = max(1, -(-len(keys) // pool.workers))
+    try:
+        slices = await pool.map(
+            "inverse_normalize_batch", [(keys[i : i + slice_size],) for i in range(0, len(keys), slice_size)]
+        )
+    except Exception as e:
+        for future in futures.values():
+            future.set_exception(e)
+    else:
+        for key, output in zip(keys, (output for outputs in slices for output in outputs)):
+            if isinstance(output, Exception):
+                futures[key].set_exception(output)
+            else:
+                parent_cache.put(key, output, generation)
+                futures[key].set_result(output)
+    finally:
+        for key, future in futures.items():
+            # cancelled, e.g. on shutdown
+            if not future.done():
+                future.cancel()
+            if in_flight.get(key) is future:
+                del in_flight[key]
+
+async def normalize_cached(keys: List[str]) -> Dict[str, Union[str, Exception]]:
+    """
+    Returns written form of whitespace-normalized `keys` from the cache of the server process, keys being normalized
+    for another request are awaited, the others are normalized. Failed keys map to the exception.
+    """
+    outputs = {}
+    for key in keys:
+        output = parent_cache.get(key)
+        if output is not None:
+            outputs[key] = output
+    misses = [key for key in keys if key not in outputs]
+    new = [key for key in misses if key not in in_flight]
+    if len(new) < len(misses):
+        metrics.inc(f"{parent_cache.name}_coalesced_total", len(misses) - len(new))
+    if new:
+        start_flights(new)
+    futures = [in_flight[key] for key in misses]
+    # shielded, a request that goes away does not cancel the flight other requests wait for
+    results = await asyncio.gather(*(asyncio.shield(future) for future in futures), return_exceptions=True)
+    outputs.update(zip(misses, results))
+    return outputs
+
+async def normalize_text(text: str) -> str:
+    if batcher is not None:
+        return await batcher.submit(text)
+    if parent_cache is None:
+        return await pool.run("inverse_normalize", text)
+    key = " ".join(text.split())
+    output = (await normalize_cached([key]))[key]
+    if isinstance(output, Exception):
+        raise output
+    return output
+
 @app.post("/normalize", response_model=NormalizationResponse)
 async def normalize_endpoint(request: NormalizationRequest):
-    normalized = inverse_normalizer.inverse_normalize(request.text)
+    try:
+        normalized = await normalize_text(request.text)
+    except PoolFull as e:
+        raise queue_full(e)
     return NormalizationResponse(normalized_text=normalized)
 
+class TimedWord(BaseModel):
+    word: str
+    start: float
+    end: float
+
+class WordsNormalizationRequest(BaseModel):
+    words: List[TimedWord] = Field(
+        ...,
+        example=[{"word": "ba", "start": 1.0, "end": 1.2}, {"word": "mươi", "start": 1.2, "end": 1.5}],
+        description="ASR words with start and end times",
+    )
+
+class WordsNormalizationResponse(BaseModel):
+    normalized_text: str
+    words: List[TimedWord]
+
+@app.post("/normalize/words", response_model=WordsNormalizationResponse)
+async def normalize_words_endpoint(request: WordsNormalizationRequest):
+    if len(request.words) > max_batch_size:
+        raise HTTPException(status_code=413, detail=f"Request has {len(request.words)} words, at most {max_batch_size} allowed")
+    # each written token comes with the time span of the spoken words it was made from
+    try:
+        tokens = await pool.run("inverse_normalize_words", [(w.word, w.start, w.end) for w in request.words])
+    except PoolFull as e:
+        raise queue_full(e)
+    except ValueError as e:
+        # the tagger found no path through the words
+        raise HTTPException(status_code=422, detail=f"Words could not be normalized: {e}")
+    return WordsNormalizationResponse(
+        normalized_text=" ".join(word for word, _, _ in tokens),
+        words=[TimedWord(word=word, start=start, end=end) for word, start, end in tokens],
+    )
+
+@app.websocket("/normalize/ws")
+async def normalize_ws_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    session = StreamSession(lambda: inverse_normalizer.invert_text_normalizer.triggers, normalize_text)
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+                committed, tail = await session.update(
+                    message["text"], final=bool(message.get("final")), flush=bool(message.get("flush"))
+                )
+            except (ValueError, KeyError, TypeError) as e:
+                await websocket.send_json({"error": f"Invalid message: {e!r}"})
+                continue
+            except PoolFull as e:
+                await websocket.send_json({"error": f"Server is busy: {e}"})
+                continue
+            await websocket.send_json({"committed": committed, "tail": tail})
+    except WebSocketDisconnect:
+        pass
+
+class BatchNormalizationRequest(BaseModel):
+    texts: List[str] = Field(
+        ..., example=["một triệu đồng", "ngày ba mươi tháng tư"], description="Texts to normalize"
+    )
+
+class BatchItem(BaseModel):
+    normalized_text: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchNormalizationResponse(BaseModel):
+    results: List[BatchItem]
+
+@app.post("/normalize/batch", response_model=BatchNormalizationResponse)
+async def normalize_batch_endpoint(request: BatchNormalizationRequest):
+    if len(request.texts) > max_batch_size:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(request.texts)} texts, at most {max_batch_size} allowed")
+    size = sum(len(text.encode("utf-8")) for text in request.texts)
+    if size > max_batch_bytes:
+        raise HTTPException(status_code=413, detail=f"Batch has {size} bytes, at most {max_batch_bytes} allowed")
+    # unique texts are split into one slice per worker
+    keys = [" ".join(text.split()) for text in request.texts]
+    unique = list(dict.fromkeys(keys))
+    if parent_cache is not None:
+        normalized = await normalize_cached(unique)
+        busy = next((output for output in normalized.values() if isinstance(output, PoolFull)), None)
+        if busy is not None:
+            raise queue_full(busy)
+    else:
+        slice_size = max(1, -(-len(unique) // pool.workers))
+        try:
+            slices = await pool.map(
+                "inverse_normalize_batch", [(unique[i : i + slice_size],) for i in range(0, len(unique), slice_size)]
+            )
+        except PoolFull as e:
+            raise queue_full(e)
+        normalized = dict(zip(unique, (output for outputs in slices for output in outputs)))
+    outputs = [normalized[key] for key in keys]
+    metrics.observe("viet_itn_batch_size", len(request.texts), buckets=SIZE_BUCKETS)
+    metrics.inc("viet_itn_batch_texts_total", len(request.texts))
+    metrics.inc("viet_itn_batch_unique_total", len(unique))
+    results = []
+    for text, output in zip(request.texts, outputs):
+        if isinstance(output, Exception):
+            metrics.inc("viet_itn_batch_errors_total")
+            logger.warning(f"Failed to normalize {text!r}: {output!r}")
+            results.append(BatchItem(error=f"{type(output).__name__}: {output}"))
+        else:
+            results.append(BatchItem(normalized_text=output))
+    return BatchNormalizationResponse(results=results)
+
+class DuplexStreamingResponse(StreamingResponse):
+    # the body iterator reads the request body while the response is sent, so `receive` is left to it
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+async def normalize_retrying(text: str) -> str:
+    # wait for a free worker instead of failing the line, the stream is paced by the workers anyway
+    while True:
+        try:
+            return await normalize_text(text)
+        except PoolFull:
+            await asyncio.sleep(0.01)
+
+async def request_chunks(request: Request):
+    try:
+        async for chunk in request.stream():
+            yield chunk
+    except ClientDisconnect:
+        logger.info("Client disconnected from /normalize/stream")
+
+async def parse_lines(request: Request, ndjson: bool):
+    index = 0
+    async for line in read_lines(request_chunks(request), max_batch_bytes):
+        if ndjson and line is not None and not line.strip():
+            continue
+        try:
+            if line is None:
+                raise ValueError(f"Line is longer than {max_batch_bytes} bytes")
+            item = json.loads(line) if ndjson else line.decode("utf-8")
+            text = item["text"] if isinstance(item, dict) else item
+            if not isinstance(text, str):
+                raise ValueError(f"Expected a string or an object with a text field, got {line[:100]!r}")
+        except (ValueError, KeyError) as e:
+            text = e
+        yield index, text
+        index += 1
+
+@app.post("/normalize/stream")
+async def normalize_stream_endpoint(request: Request, order: str = Query("input", pattern="^(input|completion)$")):
+    ndjson = request.headers.get("content-type", "").startswith(("application/x-ndjson", "application/jsonl"))
+
+    async def normalize_item(item):
+        if isinstance(item, Exception):
+            raise item
+        return await normalize_retrying(item)
+
+    async def results():
+        async for index, output in normalize_lines(
+            parse_lines(request, ndjson), normalize_item, stream_window, ordered=order == "input"
+        ):
+            metrics.inc("viet_itn_ndjson_lines_total")
+            if isinstance(output, Exception):
+                metrics.inc("viet_itn_ndjson_errors_total")
+                record = {"index": index, "error": f"{type(output).__name__}: {output}"}
+            else:
+                record = {"index": index, "normalized_text": output}
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    return DuplexStreamingResponse(results(), media_type="application/x-ndjson")
+
 @app.post("/normalize_2", response_model=NormalizationResponse)
 async def normalize_endpoint_2(request: NormalizationRequest):
     normalized = inverse_normalizer.inverse_normalize_2(request.text)
     return NormalizationResponse(normalized_text=normalized)
 
+@app.post("/admin/reload")
+async def reload_endpoint(x_admin_token: Optional[str] = Header(None)):
+    token = os.environ.get("VIET_ITN_ADMIN_TOKEN")
+    if token and x_admin_token != token:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if reload_lock.locked():
+        raise HTTPException(status_code=409, detail="A reload is already running")
+    try:
+        return await reload_grammars()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed: {e}")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return metrics.render()
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
@@ -1,17 +1,278 @@
 import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from src.corpus_job import CorpusJob, normalize_line
 from src.normalize import InverseTextNormalizer
+from src.worker_pool import watch_parent
+
+# normalizer of the `viet-itn file` workers, inherited when the pool forks them
+_normalizer = None
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Inverse normalize text")
     parser.add_argument("input", type=str, help="input text")
     parser.add_argument("--verbose", action="store_true", help="print intermediate tokens")
+    parser.add_argument("--bundle", type=str, default=os.environ.get("VIET_ITN_BUNDLE"), help="grammar bundle created with `viet-itn compile`")
     return parser.parse_args()
 
+def parse_compile_args(argv):
+    parser = argparse.ArgumentParser(prog="viet-itn compile", description="Compile tagger and verbalizer into a grammar bundle")
+    parser.add_argument("output_dir", type=str, help="bundle directory")
+    parser.add_argument("--input_case", type=str, choices=["lower_cased", "cased"], default="lower_cased", help="input text capitalization")
+    parser.add_argument("--whitelist", type=str, default=None, help="file with whitelist replacements")
+    parser.add_argument("--n_jobs", type=int, default=os.cpu_count(), help="number of processes compiling sub-grammars, -1 for all CPUs")
+    return parser.parse_args(argv)
+
+def compile_main(argv):
+    from src.inverse_text_normalization.vi.bundle import compile_bundle
+
+    args = parse_compile_args(argv)
+    manifest = compile_bundle(args.output_dir, input_case=args.input_case, whitelist=args.whitelist, n_jobs=args.n_jobs)
+    print(json.dumps(manifest, indent=2, ensure_ascii=False))
+
+def parse_benchmark_args(argv):
+    parser = argparse.ArgumentParser(prog="viet-itn benchmark", description="Compare speed and output of the normalization engines")
+    parser.add_argument("input_file", type=str, help="file with one sentence per line")
+    parser.add_argument("--bundle", type=str, default=os.environ.get("VIET_ITN_BUNDLE"), help="grammar bundle created with `viet-itn compile`")
+    parser.add_argument("--repeat", type=int, default=3, help="number of passes over the input")
+    return parser.parse_args(argv)
+
+def benchmark_main(argv):
+    args = parse_benchmark_args(argv)
+    with open(args.input_file, encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+
+    engines = {
+        "nemo": InverseTextNormalizer(bundle_dir=args.bundle, native_tokens=False, order_metrics=False),
+        "pipeline": InverseTextNormalizer(bundle_dir=args.bundle),
+        "composed": InverseTextNormalizer(bundle_dir=args.bundle, engine="composed"),
+    }
+    outputs = {}
+    for name, normalizer in engines.items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            outputs[name] = [normalizer.inverse_normalize(text) for text in texts]
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(f"{name}: {elapsed / len(texts) * 1000:.3f} ms/sentence")
+    for name in engines:
+        mismatches = [(text, expected, actual) for text, expected, actual in zip(texts, outputs["nemo"], outputs[name]) if expected != actual]
+        print(f"{name}: {len(texts) - len(mismatches)}/{len(texts)} outputs match nemo")
+        for text, expected, actual in mismatches:
+            print(f"  {text}\n    nemo: {expected}\n    {name}: {actual}")
+
+def parse_file_args(argv):
+    parser = argparse.ArgumentParser(prog="viet-itn file", description="Inverse normalize files or stdin line by line")
+    parser.add_argument("inputs", type=str, nargs="*", default=["-"], help="input files, - for stdin")
+    parser.add_argument("--output", type=str, default="-", help="output file, - for stdout")
+    parser.add_argument("--format", type=str, choices=["text", "jsonl"], default="text", help="one text per line or one JSON object per line")
+    parser.add_argument("--field", type=str, default="text", help="JSONL field holding the text")
+    parser.add_argument("--output_field", type=str, default="normalized_text", help="JSONL field the written form is stored in")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes sharing the loaded grammars")
+    parser.add_argument("--batch_size", type=int, default=64, help="lines sent to a worker at once")
+    parser.add_argument("--bundle", type=str, default=os.environ.get("VIET_ITN_BUNDLE"), help="grammar bundle created with `viet-itn compile`")
+    parser.add_argument("--engine", type=str, choices=["pipeline", "composed"], default="pipeline", help="normalization engine")
+    return parser.parse_args(argv)
+
+def read_lines(inputs):
+    for name in inputs:
+        f = sys.stdin if name == "-" else open(name, encoding="utf-8")
+        try:
+            for line in f:
+                yield line.rstrip("\r\n")
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def normalize_lines(lines, jsonl, field, output_field):
+    results = []
+    for line in lines:
+        start = time.perf_counter()
+        output, error = normalize_line(_normalizer, line, jsonl, field, output_field)
+        results.append((output, error, time.perf_counter() - start))
+    return results
+
+def file_main(argv):
+    global _normalizer
+    args = parse_file_args(argv)
+    _normalizer = InverseTextNormalizer(bundle_dir=args.bundle, engine=args.engine)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    lines = read_lines(args.inputs)
+    batches = iter(lambda: list(itertools.islice(lines, args.batch_size)), [])
+    job = (args.format == "jsonl", args.field, args.output_field)
+
+    executor = None
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("fork"), initializer=watch_parent, initargs=(os.getpid(),))
+    # batches in flight, results are written in input order as soon as the oldest one is done
+    pending = collections.deque()
+    latencies = array("d")
+    n_lines = n_chars = n_errors = 0
+    start = time.perf_counter()
+    try:
+        for batch in itertools.chain(batches, [None]):
+            if batch is not None:
+                n_lines += len(batch)
+                n_chars += sum(len(line) for line in batch)
+                pending.append(executor.submit(normalize_lines, batch, *job) if executor else normalize_lines(batch, *job))
+            while pending and (batch is None or len(pending) > 2 * args.workers or not executor or pending[0].done()):
+                results = pending.popleft()
+                for output, error, seconds in results.result() if executor else results:
+                    if error:
+                        n_errors += 1
+                        print(f"Failed to normalize line {len(latencies) + 1}: {error}", file=sys.stderr)
+                    out.write(output + "\n")
+                    latencies.append(seconds)
+                out.flush()
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    ranked = sorted(latencies)
+    percentile = lambda p: ranked[min(len(ranked) - 1, int(p * len(ranked)))] * 1000 if ranked else 0.0
+    print(
+        f"{n_lines} lines, {n_chars} chars in {elapsed:.2f}s: {n_lines / elapsed:.1f} lines/s, {n_chars / elapsed:.0f} chars/s, "
+        f"p50 {percentile(0.5):.2f} ms/line, p99 {percentile(0.99):.2f} ms/line, {n_errors} errors",
+        file=sys.stderr,
+    )
+
+def parse_job_args(argv):
+    parser = argparse.ArgumentParser(prog="viet-itn job", description="Inverse normalize a large file as a resumable sharded job")
+    parser.add_argument("input", type=str, help="input file, one text or JSON record per line")
+    parser.add_argument("output", type=str, help="output file")
+    parser.add_argument("--work_dir", type=str, default=None, help="directory for shard outputs, checkpoints and locks, shared by all runs of the job (default: <output>.work)")
+    parser.add_argument("--shard_mb", type=float, default=64, help="approximate shard size in MiB")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes sharing the loaded grammars")
+    parser.add_argument("--format", type=str, choices=["text", "jsonl"], default="text", help="one text per line or one JSON object per line")
+    parser.add_argument("--field", type=str, default="text", help="JSONL field holding the text")
+    parser.add_argument("--output_field", type=str, default="normalized_text", help="JSONL field the written form is stored in")
+    parser.add_argument("--lock_timeout", type=float, default=600, help="seconds after which a shard lock that is not refreshed is taken over")
+    parser.add_argument("--bundle", type=str, default=os.environ.get("VIET_ITN_BUNDLE"), help="grammar bundle created with `viet-itn compile`")
+    parser.add_argument("--engine", type=str, choices=["pipeline", "composed"], default="pipeline", help="normalization engine")
+    return parser.parse_args(argv)
+
+def job_main(argv):
+    args = parse_job_args(argv)
+    job = CorpusJob(
+        InverseTextNormalizer(bundle_dir=args.bundle, engine=args.engine),
+        args.input,
+        args.output,
+        args.work_dir or f"{args.output}.work",
+        shard_bytes=int(args.shard_mb * (1 << 20)),
+        workers=args.workers,
+        jsonl=args.format == "jsonl",
+        field=args.field,
+        output_field=args.output_field,
+        lock_timeout=args.lock_timeout,
+    )
+    stats = job.run()
+    print(
+        f"{stats['lines']} lines in {stats['shards']} shards, {stats['errors']} errors. This run: {stats['processed_shards']} shards, "
+        f"{stats['processed_lines'] / stats['seconds']:.1f} lines/s, {stats['processed_bytes'] / stats['seconds'] / (1 << 20):.2f} MiB/s",
+        file=sys.stderr,
+    )
+
+def parse_columns_args(argv):
+    parser = argparse.ArgumentParser(prog="viet-itn columns", description="Inverse normalize text columns of a CSV, TSV or Parquet table")
+    parser.add_argument("input", type=str, help="input table, .csv, .tsv or .parquet (needs pyarrow)")
+    parser.add_argument("output", type=str, help="output table in the same format")
+    parser.add_argument("--columns", type=str, nargs="+", required=True, help="columns to normalize")
+    parser.add_argument("--suffix", type=str, default="_itn", help="written form goes into <column><suffix>, an empty suffix replaces the column")
+    parser.add_argument("--chunk_rows", type=int, default=65536, help="rows per chunk of CSV/TSV input, Parquet is read by row group")
+    parser.add_argument("--memo_size", type=int, default=1_000_000, help="distinct values remembered across chunks")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes normalizing the distinct values of a chunk")
+    parser.add_argument("--bundle", type=str, default=os.environ.get("VIET_ITN_BUNDLE"), help="grammar bundle created with `viet-itn compile`")
+    parser.add_argument("--engine", type=str, choices=["pipeline", "composed"], default="pipeline", help="normalization engine")
+    return parser.parse_args(argv)
+
+def columns_main(argv):
+    from src.columns import ColumnNormalizer
+
+    args = parse_columns_args(argv)
+    normalizer = ColumnNormalizer(
+        InverseTextNormalizer(bundle_dir=args.bundle, engine=args.engine),
+        args.columns,
+        suffix=args.suffix,
+        chunk_rows=args.chunk_rows,
+        memo_size=args.memo_size,
+        n_jobs=args.workers,
+    )
+    start = time.perf_counter()
+    stats = normalizer.normalize_file(args.input, args.output)
+    print(
+        f"{stats['rows']} rows, {stats['values']} values, {stats['normalized']} normalized ({stats['dedup_ratio']:.1f}x dedup), "
+        f"{stats['errors']} failed values in {time.perf_counter() - start:.2f}s, roughly {stats['seconds_saved']:.2f}s saved by dedup",
+        file=sys.stderr,
+    )
+
+def parse_subtitles_args(argv):
+    parser = argparse.ArgumentParser(prog="viet-itn subtitles", description="Inverse normalize the cue text of SRT and WebVTT files")
+    parser.add_argument("inputs", type=str, nargs="+", help="subtitle files, or directories searched for .srt and .vtt files")
+    parser.add_argument("--output_dir", type=str, default=None, help="directory the normalized files are written to, keeping paths relative to input directories (default: <name>.itn.<ext> next to the input)")
+    parser.add_argument("--window", type=int, default=256, help="cues normalized together")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes sharing the loaded grammars, each normalizing one file at a time")
+    parser.add_argument("--bundle", type=str, default=os.environ.get("VIET_ITN_BUNDLE"), help="grammar bundle created with `viet-itn compile`")
+    parser.add_argument("--engine", type=str, choices=["pipeline", "composed"], default="pipeline", help="normalization engine")
+    return parser.parse_args(argv)
+
+def subtitles_main(argv):
+    from src.subtitles import find_subtitles, normalize_subtitle_files
+
+    args = parse_subtitles_args(argv)
+    files = []
+    for path in args.inputs:
+        for input_path in find_subtitles([path], exclude=args.output_dir):
+            if args.output_dir is None:
+                stem, extension = os.path.splitext(input_path)
+                output_path = f"{stem}.itn{extension}"
+            else:
+                relative = os.path.relpath(input_path, path) if os.path.isdir(path) else os.path.basename(input_path)
+                output_path = os.path.join(args.output_dir, relative)
+            files.append((input_path, output_path))
+    normalizer = InverseTextNormalizer(bundle_dir=args.bundle, engine=args.engine)
+    n_cues = n_joined = n_errors = n_bytes = 0
+    failed = 0
+    start = time.perf_counter()
+    for input_path, stats, error in normalize_subtitle_files(normalizer, files, workers=args.workers, window=args.window):
+        if error:
+            failed += 1
+            print(f"Failed to normalize {input_path}: {error}", file=sys.stderr)
+            continue
+        n_cues += stats["cues"]
+        n_joined += stats["joined"]
+        n_errors += stats["errors"]
+        n_bytes += os.path.getsize(input_path)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(files) - failed} files, {n_cues} cues in {elapsed:.2f}s: {(len(files) - failed) / elapsed:.1f} files/s, "
+        f"{n_bytes / elapsed / (1 << 20):.2f} MiB/s, {n_joined} phrases joined across line breaks, {n_errors} errors, {failed} files failed",
+        file=sys.stderr,
+    )
+
+COMMANDS = {
+    "compile": compile_main,
+    "benchmark": benchmark_main,
+    "file": file_main,
+    "job": job_main,
+    "columns": columns_main,
+    "subtitles": subtitles_main,
+}
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
     args = parse_args()
-    result = InverseTextNormalizer().inverse_normalize(args.input, args.verbose)
+    result = InverseTextNormalizer(bundle_dir=args.bundle).inverse_normalize(args.input, args.verbose)
     print(result)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
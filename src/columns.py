@@ -0,0 +1,154 @@
+import csv
+import os
+import time
+from typing import Dict, Iterator, List, Optional
+
+from src.result_cache import ResultCache
+
+
+class ColumnNormalizer:
+    """
+    Inverse normalizes text columns of CSV, TSV or Parquet tables chunk by chunk. Within a chunk every distinct value
+    is normalized once and results are mapped back to the rows, across chunks results are remembered for up to
+    `memo_size` distinct values. Parquet needs pyarrow and is read one row group at a time.
+
+    Args:
+        normalizer: InverseTextNormalizer
+        columns: names of the columns to normalize
+        suffix: written form goes into a new column `<name><suffix>`, or replaces the column if empty
+        chunk_rows: rows per chunk of CSV/TSV input
+        memo_size: distinct values remembered across chunks
+        n_jobs: worker processes normalizing the distinct values of a chunk
+    """
+
+    def __init__(
+        self,
+        normalizer,
+        columns: List[str],
+        suffix: str = "_itn",
+        chunk_rows: int = 65536,
+        memo_size: int = 1_000_000,
+        n_jobs: int = 1,
+    ):
+        self.normalizer = normalizer
+        self.columns = columns
+        self.suffix = suffix
+        self.chunk_rows = chunk_rows
+        self.memo = ResultCache(memo_size, name="viet_itn_column_memo")
+        self.failed = set()
+        self.n_jobs = n_jobs
+        self.stats = {"rows": 0, "values": 0, "normalized": 0, "errors": 0, "seconds": 0.0}
+
+    def normalize_values(self, values: List[Optional[str]]) -> List[Optional[str]]:
+        """Returns written form of each value, None and empty values are kept, values that fail are kept as they are."""
+        keys = [" ".join(value.split()) if value else None for value in values]
+        outputs = {}
+        misses = []
+        for key in dict.fromkeys(key for key in keys if key):
+            if key in self.failed:
+                continue
+            output = self.memo.get(key)
+            if output is None:
+                misses.append(key)
+            else:
+                outputs[key] = output
+        start = time.perf_counter()
+        results = self.normalizer.inverse_normalize_batch(misses, n_jobs=self.n_jobs) if misses else []
+        self.stats["seconds"] += time.perf_counter() - start
+        for key, output in zip(misses, results):
+            if isinstance(output, Exception):
+                self.stats["errors"] += 1
+                # failures are remembered too, up to memo_size of them, so later chunks do not retry them
+                if len(self.failed) < self.memo.max_entries:
+                    self.failed.add(key)
+            else:
+                self.memo.put(key, output)
+                outputs[key] = output
+        self.stats["values"] += sum(1 for key in keys if key)
+        self.stats["normalized"] += len(misses)
+        return [outputs.get(key, value) if key else value for key, value in zip(keys, values)]
+
+    def _output_name(self, column: str) -> str:
+        return f"{column}{self.suffix}"
+
+    def _check(self, names: List[str]):
+        missing = [column for column in self.columns if column not in names]
+        if missing:
+            raise ValueError(f"Columns {missing} not found, the table has {names}")
+
+    def _csv_chunks(self, reader: Iterator[Dict[str, str]]) -> Iterator[List[Dict[str, str]]]:
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) == self.chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def normalize_csv(self, input_path: str, output_path: str, delimiter: str = ","):
+        with open(input_path, newline="", encoding="utf-8") as f_in, open(output_path, "w", newline="", encoding="utf-8") as f_out:
+            reader = csv.DictReader(f_in, delimiter=delimiter)
+            names = list(reader.fieldnames or [])
+            self._check(names)
+            output_names = names + [self._output_name(c) for c in self.columns if self._output_name(c) not in names]
+            writer = csv.writer(f_out, delimiter=delimiter)
+            writer.writerow(output_names)
+            for chunk in self._csv_chunks(reader):
+                for column in self.columns:
+                    output = self.normalize_values([row[column] for row in chunk])
+                    for row, value in zip(chunk, output):
+                        row[self._output_name(column)] = value
+                # fields of a row beyond the header, which DictReader keeps under None, are written after the others
+                writer.writerows([row.get(name) for name in output_names] + row.get(None, []) for row in chunk)
+                self.stats["rows"] += len(chunk)
+
+    def normalize_parquet(self, input_path: str, output_path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet tables need pyarrow, install it with `pip install pyarrow`")
+
+        source = pq.ParquetFile(input_path)
+        self._check(source.schema_arrow.names)
+        writer = None
+        try:
+            for i in range(source.num_row_groups):
+                table = source.read_row_group(i)
+                for column in self.columns:
+                    output = pa.array(self.normalize_values(table.column(column).to_pylist()), type=pa.string())
+                    name = self._output_name(column)
+                    if name in table.column_names:
+                        table = table.set_column(table.column_names.index(name), name, output)
+                    else:
+                        table = table.append_column(name, output)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+                self.stats["rows"] += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def normalize_file(self, input_path: str, output_path: str) -> Dict:
+        """
+        Normalizes a table, the format is taken from the extension of `input_path`: .csv, .tsv or .parquet
+
+        Returns statistics with the number of distinct values that failed, the dedup ratio (values per normalized
+        value) and a rough estimate of the time saved by not normalizing repeated values: the mean wall time per
+        normalized value, which with n_jobs > 1 includes starting the worker processes, times the values not normalized
+        """
+        self.stats = {"rows": 0, "values": 0, "normalized": 0, "errors": 0, "seconds": 0.0}
+        extension = os.path.splitext(input_path)[1].lower()
+        if extension == ".parquet":
+            self.normalize_parquet(input_path, output_path)
+        elif extension in (".csv", ".tsv"):
+            self.normalize_csv(input_path, output_path, delimiter="\t" if extension == ".tsv" else ",")
+        else:
+            raise ValueError(f"Unsupported table format {extension}, expected .csv, .tsv or .parquet")
+        stats = dict(self.stats)
+        stats["dedup_ratio"] = stats["values"] / stats["normalized"] if stats["normalized"] else 0.0
+        per_value = stats["seconds"] / stats["normalized"] if stats["normalized"] else 0.0
+        stats["seconds_saved"] = (stats["values"] - stats["normalized"]) * per_value
+        return stats
@@ -0,0 +1,343 @@
+import glob
+import json
+import mmap
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from src.worker_pool import watch_parent
+
+MANIFEST_FILE = "job.json"
+# normalizer of the shard workers, inherited when the pool forks them
+_normalizer = None
+
+
+def normalize_line(normalizer, line: str, jsonl: bool, field: str, output_field: str) -> Tuple[str, Optional[str]]:
+    """
+    Returns written form of a plain text line, or the JSON record with `output_field` added for JSONL,
+    and the error if it could not be normalized, then the line is kept (plain text) or turned into an error record.
+    """
+    try:
+        if not line.strip():
+            return line, None
+        if not jsonl:
+            return normalizer.inverse_normalize(line), None
+        record = json.loads(line)
+        record[output_field] = normalizer.inverse_normalize(record[field])
+        return json.dumps(record, ensure_ascii=False), None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        return (json.dumps({"line": line, "error": error}, ensure_ascii=False) if jsonl else line), error
+
+
+def shard_ranges(path: str, shard_bytes: int) -> List[Tuple[int, int]]:
+    """Splits a file into byte ranges of about `shard_bytes`, each ending after a newline or at the end of the file."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    ranges = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            newline = data.find(b"\n", min(start + shard_bytes, size) - 1)
+            end = size if newline == -1 else newline + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _run_shard(input_path: str, start: int, end: int, output_path: str, jsonl: bool, field: str, output_field: str) -> Dict:
+    begin = time.perf_counter()
+    with open(input_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        text = data[start:end].decode("utf-8")
+    lines = text.split("\n")
+    if text.endswith("\n"):
+        lines.pop()
+    errors = 0
+    tmp = f"{output_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as out:
+        for line in lines:
+            output, error = normalize_line(_normalizer, line.rstrip("\r"), jsonl, field, output_field)
+            errors += error is not None
+            out.write(output + "\n")
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, output_path)
+    return {"lines": len(lines), "bytes": end - start, "errors": errors, "seconds": time.perf_counter() - begin}
+
+
+class CorpusJob:
+    """
+    Inverse normalizes a large line-based file (plain text or JSONL) as a resumable job.
+
+    The input is memory-mapped and split into shards of about `shard_bytes` on line boundaries, recorded in
+    `<work_dir>/job.json`. Shards are normalized by forked worker processes that share the loaded grammars,
+    each into `<work_dir>/shards/<index>.out`, written atomically. A finished shard is never redone, so a crashed
+    or preempted run started again with the same arguments resumes where it stopped. Once all shards are done they
+    are concatenated in shard order into the output, which is the same whatever ran where and in which order.
+    A finished job run again with another output, or after its output was removed, merges the shard outputs again.
+
+    Several runs, e.g. on machines sharing the file system, can work on the same job. A run claims a shard by
+    creating `<index>.lock` exclusively and touches it while the shard is processed. Locks of dead local processes,
+    or not touched for `lock_timeout` seconds, are taken over. Shard outputs only depend on the input and the
+    grammars, so a shard processed twice after such a takeover race gives the same file.
+
+    Args:
+        normalizer: InverseTextNormalizer shared by the workers
+        input_path: file with one text or JSON record per line
+        output_path: merged output, one line per input line
+        work_dir: directory with the job manifest, shard outputs and locks
+        shard_bytes: approximate size of a shard
+        workers: number of worker processes
+        jsonl: whether lines are JSON records with the text in `field`, written back with `output_field` added
+        lock_timeout: seconds after which a lock that was not touched is considered abandoned
+    """
+
+    def __init__(
+        self,
+        normalizer,
+        input_path: str,
+        output_path: str,
+        work_dir: str,
+        shard_bytes: int = 64 << 20,
+        workers: int = 1,
+        jsonl: bool = False,
+        field: str = "text",
+        output_field: str = "normalized_text",
+        lock_timeout: float = 600,
+    ):
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+        self.normalizer = normalizer
+        self.input_path = os.path.abspath(input_path)
+        self.output_path = output_path
+        self.work_dir = work_dir
+        self.shard_dir = os.path.join(work_dir, "shards")
+        self.workers = workers
+        self.jsonl = jsonl
+        self.field = field
+        self.output_field = output_field
+        self.lock_timeout = lock_timeout
+        self.owner = f"{socket.gethostname()} {os.getpid()}"
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.shards = self._load_manifest(shard_bytes)
+
+    def _load_manifest(self, shard_bytes: int) -> List[Tuple[int, int]]:
+        stat = os.stat(self.input_path)
+        job = {
+            # relative, runs may mount the shared file system at different points
+            "input": os.path.relpath(self.input_path, self.work_dir),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "shard_bytes": shard_bytes,
+            "jsonl": self.jsonl,
+            "field": self.field,
+            "output_field": self.output_field,
+        }
+        manifest_file = os.path.join(self.work_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            manifest = dict(job, shards=shard_ranges(self.input_path, shard_bytes))
+            tmp = f"{manifest_file}.{socket.gethostname()}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp, manifest_file)
+        with open(manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+        changed = [key for key, value in job.items() if manifest.get(key) != value]
+        if changed:
+            raise ValueError(
+                f"{self.work_dir} belongs to a job with different {', '.join(changed)}, use another work dir or remove it"
+            )
+        return [tuple(shard) for shard in manifest["shards"]]
+
+    def _path(self, index: int, suffix: str) -> str:
+        return os.path.join(self.shard_dir, f"{index:06d}.{suffix}")
+
+    def _claim(self, lock: str) -> bool:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(self.owner)
+        return True
+
+    def _abandoned(self, lock: str) -> bool:
+        try:
+            with open(lock) as f:
+                host, _, pid = f.read().partition(" ")
+            age = time.time() - os.stat(lock).st_mtime
+        except (FileNotFoundError, ValueError):
+            return False
+        if host == socket.gethostname() and pid.isdigit() and f"{host} {pid}" != self.owner:
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return age > self.lock_timeout
+
+    def _acquire(self, lock: str) -> bool:
+        if self._claim(lock):
+            return True
+        if not self._abandoned(lock):
+            return False
+        # only one run can rename the abandoned lock away
+        taken = f"{lock}.{socket.gethostname()}.{os.getpid()}"
+        try:
+            os.rename(lock, taken)
+        except FileNotFoundError:
+            return False
+        os.remove(taken)
+        return self._claim(lock)
+
+    def _heartbeat(self, locks: set, stop: threading.Event):
+        while not stop.wait(self.lock_timeout / 4):
+            for lock in list(locks):
+                try:
+                    os.utime(lock)
+                except FileNotFoundError:
+                    pass
+
+    def run(self, poll_interval: float = 10) -> Dict:
+        """
+        Processes every shard no other run is working on, waits for the others and merges.
+
+        Returns statistics of the whole job and of the shards processed by this run
+        """
+        global _normalizer
+        _normalizer = self.normalizer
+        start = time.perf_counter()
+        processed = []
+        failed = []
+        locks = set()
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(locks, stop), daemon=True)
+        heartbeat.start()
+        executor = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=watch_parent,
+            initargs=(os.getpid(),),
+        )
+        try:
+            while True:
+                todo = [i for i in range(len(self.shards)) if not os.path.exists(self._path(i, "json"))]
+                if not todo:
+                    break
+                running = {}
+                for index in todo:
+                    if os.path.exists(self._path(index, "json")) or not self._acquire(self._path(index, "lock")):
+                        continue
+                    locks.add(self._path(index, "lock"))
+                    for leftover in glob.glob(f"{glob.escape(self._path(index, 'out'))}.*.tmp"):
+                        # partial output of a run that died on this shard
+                        os.remove(leftover)
+                    shard_start, shard_end = self.shards[index]
+                    future = executor.submit(
+                        _run_shard,
+                        self.input_path,
+                        shard_start,
+                        shard_end,
+                        self._path(index, "out"),
+                        self.jsonl,
+                        self.field,
+                        self.output_field,
+                    )
+                    running[future] = index
+                    while len(running) >= self.workers:
+                        self._collect(wait(running, return_when=FIRST_COMPLETED).done, running, locks, processed, failed)
+                self._collect(wait(running).done, running, locks, processed, failed)
+                if failed:
+                    raise RuntimeError(f"Shards {sorted(failed)} failed, run the job again to retry them")
+                if any(not os.path.exists(self._path(i, "json")) for i in todo):
+                    # shards held by other runs
+                    time.sleep(poll_interval)
+            executor.shutdown()
+            self._merge(locks)
+        finally:
+            stop.set()
+            executor.shutdown(cancel_futures=True)
+
+        stats = [self._stats(i) for i in range(len(self.shards))]
+        return {
+            "shards": len(self.shards),
+            "lines": sum(s["lines"] for s in stats),
+            "errors": sum(s["errors"] for s in stats),
+            "processed_shards": len(processed),
+            "processed_lines": sum(stats[i]["lines"] for i in processed),
+            "processed_bytes": sum(stats[i]["bytes"] for i in processed),
+            "seconds": time.perf_counter() - start,
+        }
+
+    def _collect(self, done, running: Dict, locks: set, processed: List[int], failed: List[int]):
+        for future in done:
+            index = running.pop(future)
+            lock = self._path(index, "lock")
+            try:
+                stats = future.result()
+            except Exception:
+                failed.append(index)
+            else:
+                tmp = f"{self._path(index, 'json')}.{socket.gethostname()}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(stats, f)
+                # the stats file marks the shard as done, it is written after the shard output
+                os.replace(tmp, self._path(index, "json"))
+                processed.append(index)
+            locks.discard(lock)
+            try:
+                os.remove(lock)
+            except FileNotFoundError:
+                pass
+
+    def _stats(self, index: int) -> Dict:
+        with open(self._path(index, "json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _merged(self) -> bool:
+        # the marker holds the output merged last, it is merged again if that is another path or was removed
+        try:
+            with open(os.path.join(self.work_dir, "merged"), encoding="utf-8") as f:
+                merged = f.read()
+        except FileNotFoundError:
+            return False
+        return merged == os.path.relpath(self.output_path, self.work_dir) and os.path.exists(self.output_path)
+
+    def _merge(self, locks: set):
+        if self._merged():
+            return
+        lock = os.path.join(self.work_dir, "merge.lock")
+        while not self._acquire(lock):
+            if self._merged():
+                return
+            time.sleep(1)
+        locks.add(lock)
+        try:
+            if self._merged():
+                return
+            tmp = f"{self.output_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as out:
+                for index in range(len(self.shards)):
+                    with open(self._path(index, "out"), "rb") as f:
+                        while True:
+                            block = f.read(1 << 20)
+                            if not block:
+                                break
+                            out.write(block)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, self.output_path)
+            done = os.path.join(self.work_dir, "merged")
+            tmp = f"{done}.{socket.gethostname()}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(os.path.relpath(self.output_path, self.work_dir))
+            os.replace(tmp, done)
+        finally:
+            locks.discard(lock)
+            os.remove(lock)
@@ -12,15 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
+import itertools
 import os
 from argparse import ArgumentParser
 from time import perf_counter
-from typing import List
+from typing import List, Optional, Tuple
 
+import pynini
+from pynini.lib import rewrite
+from joblib import Parallel, delayed
 from nemo_text_processing.text_normalization.data_loader_utils import load_file, write_file
 from nemo_text_processing.text_normalization.en.graph_utils import INPUT_CASED, INPUT_LOWER_CASED
-from nemo_text_processing.text_normalization.normalize import Normalizer
+from nemo_text_processing.text_normalization.normalize import SPACE_DUP, Normalizer
 from nemo_text_processing.text_normalization.token_parser import TokenParser
+from nemo_text_processing.utils.logging import logger
+from src.inverse_text_normalization.vi.composed import FALLBACK
+from src.inverse_text_normalization.vi.tokens import Token, parse_tokens, permutations, plain_text
+from src.metrics import metrics
+from src.result_cache import ResultCache
 
 
 class InverseNormalizer(Normalizer):
@@ -38,6 +48,21 @@ class InverseNormalizer(Normalizer):
         overwrite_cache: set to True to overwrite .far files
         max_number_of_permutations_per_split: a maximum number
             of permutations which can be generated from input sequence of tokens.
+        bundle_dir: path to a grammar bundle created with `viet-itn compile` (only for 'vi').
+            If set, grammars are loaded read-only from the bundle and never compiled.
+        localize_spans: (only for 'vi') tag and verbalize only the segments of a sentence that can contain
+            semiotic tokens and copy the rest, see `TriggerIndex.segments`. Keeps latency flat on long inputs.
+        native_tokens: (only for 'vi') parse the tagger output once into token records, copy plain words and
+            punctuation and verbalize each semiotic token on its own instead of going through TokenParser
+            and whole-sentence permutations. Same output.
+        order_metrics: (only with native_tokens) count semiotic tokens the verbalizer accepts in the field order
+            of the taggers in viet_itn_order_preserved_total and the others, which need permutations, in
+            viet_itn_permutation_fallback_total. `viet-itn compile` reports the classes whose field order
+            is not always accepted.
+        composed: (only for 'vi') rewrite sentences in a single pass with the tagger precomposed with the verbalizer,
+            see `ComposedFst`. Sentences it can not verbalize in tagger field order take the regular path.
+        token_cache_size: (only with native_tokens) number of verbalized tokens to memoize, keyed on the token
+            record. Hits and misses are counted in viet_itn_token_cache_*_total. Disabled if 0.
     """
 
     def __init__(
@@ -48,6 +73,12 @@ class InverseNormalizer(Normalizer):
         cache_dir: str = None,
         overwrite_cache: bool = False,
         max_number_of_permutations_per_split: int = 729,
+        bundle_dir: str = None,
+        localize_spans: bool = False,
+        native_tokens: bool = False,
+        order_metrics: bool = False,
+        composed: bool = False,
+        token_cache_size: int = 0,
     ):
 
         assert input_case in ["lower_cased", "cased"]
@@ -127,10 +158,48 @@ class InverseNormalizer(Normalizer):
                 VerbalizeFinalFst,
             )
 
-        self.tagger = ClassifyFst(
-            cache_dir=cache_dir, whitelist=whitelist, overwrite_cache=overwrite_cache, input_case=input_case
-        )
-        self.verbalizer = VerbalizeFinalFst()
+        if bundle_dir:
+            if lang != 'vi':
+                raise ValueError(f"Grammar bundles are not supported for lang={lang}")
+            from src.inverse_text_normalization.vi.bundle import load_bundle
+
+            self.tagger, self.verbalizer, _ = load_bundle(bundle_dir, composed=composed)
+        elif lang == 'vi':
+            self.tagger = ClassifyFst(
+                cache_dir=cache_dir, whitelist=whitelist, overwrite_cache=overwrite_cache, input_case=input_case
+            )
+            self.verbalizer = VerbalizeFinalFst(cache_dir=cache_dir, overwrite_cache=overwrite_cache)
+            # class taggers are only kept when the tagger was compiled rather than restored, check them then
+            if self.tagger.graphs is not None:
+                from src.inverse_text_normalization.vi.bundle import check_field_order
+
+                if not check_field_order(self.tagger.graphs, self.verbalizer.fst):
+                    logger.info("Verbalizer accepts the field order of every tagger.")
+        else:
+            self.tagger = ClassifyFst(
+                cache_dir=cache_dir, whitelist=whitelist, overwrite_cache=overwrite_cache, input_case=input_case
+            )
+            self.verbalizer = VerbalizeFinalFst()
+        # words a semiotic token can start with, sentences without any skip tagging and verbalization
+        self.triggers = None
+        if lang == 'vi':
+            from src.inverse_text_normalization.vi.triggers import TriggerIndex
+
+            self.triggers = TriggerIndex(self.tagger.triggers, self.tagger.vocabulary)
+        self.localize_spans = localize_spans
+        self.native_tokens = native_tokens and lang == 'vi'
+        self.order_metrics = order_metrics
+        self.token_cache = None
+        if token_cache_size > 0:
+            self.token_cache = ResultCache(token_cache_size, name="viet_itn_token_cache")
+        self.composed = None
+        if composed and lang == 'vi':
+            from src.inverse_text_normalization.vi.composed import ComposedFst
+
+            if bundle_dir:
+                self.composed = self.tagger.composed
+            else:
+                self.composed = ComposedFst(self.tagger, cache_dir=cache_dir, overwrite_cache=overwrite_cache)
         self.parser = TokenParser()
         self.lang = lang
         self.max_number_of_permutations_per_split = max_number_of_permutations_per_split
@@ -158,8 +227,229 @@ class InverseNormalizer(Normalizer):
 
         Returns: written form
         """
+        if self.triggers is not None and not self.triggers.punctuation_only(text):
+            if self.localize_spans:
+                return self._normalize_segments(text, verbose=verbose)
+            if not self.triggers.search(text):
+                return self.triggers.passthrough(text)
         return self.normalize(text=text, verbose=verbose)
 
+    def normalize(
+        self, text: str, verbose: bool = False, punct_pre_process: bool = False, punct_post_process: bool = False
+    ) -> str:
+        """
+        Main function. Normalizes tokens from spoken to written form, see `Normalizer.normalize`.
+        With `composed` the sentence is rewritten in a single pass unless it needs the permutation path.
+        With `native_tokens` plain words and punctuation of the tagger output are copied and only semiotic tokens
+        are verbalized, each on its own, trying field orders only until one is accepted.
+
+        Args:
+            text: string that may include semiotic classes
+            verbose: whether to print intermediate meta information
+            punct_pre_process: whether to perform punctuation pre-processing
+            punct_post_process: whether to normalize punctuation
+
+        Returns: written form
+        """
+        if self.composed is not None and not (punct_pre_process or punct_post_process):
+            try:
+                output = self.composed.rewrite(text)
+            except rewrite.Error:
+                output = FALLBACK
+            if not output.endswith(FALLBACK):
+                metrics.inc("viet_itn_composed_total")
+                return output
+            metrics.inc("viet_itn_composed_fallback_total")
+        if not self.native_tokens or punct_pre_process or punct_post_process:
+            return super().normalize(
+                text, verbose=verbose, punct_pre_process=punct_pre_process, punct_post_process=punct_post_process
+            )
+        logger.setLevel('DEBUG' if verbose else 'INFO')
+        text = text.strip()
+        if not text:
+            return text
+        tagged_text = self.select_tag(self.find_tags(pynini.escape(text)))
+        logger.debug(tagged_text)
+        output = []
+        for token in parse_tokens(tagged_text):
+            verbalized = plain_text(token)
+            if verbalized is None:
+                verbalized = self.verbalize_token(token)
+            if verbalized is None:
+                logger.warning(f"Failed text: {text}, no field order of {token} can be verbalized")
+                return text
+            output.append(verbalized)
+        return SPACE_DUP.sub(' ', ' '.join(output))
+
+    def verbalize_token(self, token: Token) -> Optional[str]:
+        """
+        Verbalizes a single token record, trying its field orders like `generate_permutations` does.
+        With `token_cache_size` results are memoized on the token record.
+
+        Args:
+            token: token record created with `parse_tokens`
+
+        Returns: written form or None if no field order is accepted by the verbalizer
+        """
+        if self.token_cache is None:
+            return self._verbalize_token(token)
+        try:
+            return self.token_cache.get_or_compute(
+                next(permutations(token)), lambda _: self._verbalize_token(token, strict=True)
+            )
+        except LookupError:
+            return None
+
+    def _verbalize_token(self, token: Token, strict: bool = False) -> Optional[str]:
+        for i, tagged_text in enumerate(permutations(token)):
+            lattice = self.find_verbalizer(pynini.escape(tagged_text))
+            if lattice.num_states() != 0:
+                if i == 0 and self.order_metrics:
+                    metrics.inc("viet_itn_order_preserved_total")
+                return self.select_verbalizer(lattice)
+            if i == 0 and self.order_metrics:
+                metrics.inc("viet_itn_permutation_fallback_total")
+        # failures are not memoized
+        if strict:
+            raise LookupError(token)
+        return None
+
+    def inverse_normalize_chunked(self, text: str, verbose: bool = False, max_words: int = 200, n_jobs: int = 1) -> str:
+        """
+        Inverse normalizes long texts chunk by chunk, so cost grows linearly with input length and the size of the
+        tagger lattice stays bounded. Chunks are cut at sentence ends and at boundaries no semiotic token can span
+        (only for 'vi'), which gives the same output as normalizing the whole text at once.
+
+        Args:
+            text: string that may include semiotic classes
+            verbose: whether to print intermediate meta information
+            max_words: maximum number of words per chunk, longer unsplittable spans stay whole
+            n_jobs: the maximum number of chunks normalized in parallel
+
+        Returns: written form
+        """
+        if self.triggers is None:
+            raise ValueError(f"Chunked inverse normalization is not supported for lang={self.lang}")
+        if self.triggers.punctuation_only(text):
+            return self.inverse_normalize(text, verbose=verbose)
+        chunks = self.triggers.chunks(text, max_words)
+        texts = [chunk for chunk, trigger in chunks if trigger]
+        batch_size = max(1, -(-len(texts) // n_jobs))
+        batches = Parallel(n_jobs=n_jobs)(
+            delayed(self._inverse_normalize_batch)(texts[i : i + batch_size], verbose)
+            for i in range(0, len(texts), batch_size)
+        )
+        normalized = itertools.chain.from_iterable(batches)
+        output = [next(normalized) if trigger else self.triggers.passthrough(chunk) for chunk, trigger in chunks]
+        return SPACE_DUP.sub(' ', ' '.join(output))
+
+    def _inverse_normalize_batch(self, texts: List[str], verbose: bool) -> List[str]:
+        return [self.inverse_normalize(text, verbose=verbose) for text in texts]
+
+    def _normalize_segments(self, text: str, verbose: bool) -> str:
+        output = [
+            self.normalize(text=segment, verbose=verbose) if trigger else self.triggers.passthrough(segment)
+            for segment, trigger in self.triggers.segments(text)
+        ]
+        return SPACE_DUP.sub(' ', ' '.join(output))
+
+    def inverse_normalize_spans(self, text: str, max_words: int = 200) -> List[Tuple[str, int, int]]:
+        """
+        Inverse normalizes `text` into written tokens, each with the span of input words it was made from,
+            e.g. ngày ba mươi tháng tư -> [("ngày", 0, 1), ("30 tháng 4", 1, 5)]
+        Spans come from the tagger pass, see `tag_spans`, so the output needs no alignment to the input.
+        The tokens joined with spaces are the written form `inverse_normalize` returns.
+
+        Args:
+            text: string that may include semiotic classes
+            max_words: maximum number of words per chunk, see `inverse_normalize_chunked`
+
+        Returns: list of (written token, index of the first word, index after the last word), indices refer to
+            the words of `text` split at white space. Punctuation split off a word has the span of that word.
+        """
+        if self.triggers is None:
+            raise ValueError(f"Word spans are not supported for lang={self.lang}")
+        output = []
+        offset = 0
+        if self.triggers.punctuation_only(text):
+            chunks = [(" ".join(text.split()), True)]
+        else:
+            chunks = self.triggers.chunks(text, max_words)
+        for chunk, trigger in chunks:
+            words = chunk.split(" ")
+            if not trigger:
+                output.extend(
+                    (mark, offset + i, offset + i + 1)
+                    for i, word in enumerate(words)
+                    for mark in self.triggers.passthrough(word).split(" ")
+                )
+            else:
+                for token, start, end in self.tag_spans(chunk):
+                    written = plain_text(token)
+                    if written is None:
+                        written = self.verbalize_token(token)
+                    if written is None:
+                        logger.warning(f"Failed text: {chunk}, no field order of {token} can be verbalized")
+                        written = " ".join(words[start:end])
+                    output.append((written, offset + start, offset + end))
+            offset += len(words)
+        return output
+
+    def tag_spans(self, text: str) -> List[Tuple[Token, int, int]]:
+        """
+        Tags `text` and returns each token with the span of input words it consumed. The arcs of the tagger's
+        shortest path are walked, keeping track of the output token while the bytes of each word are consumed.
+        A word belongs to every token the output is in between its first and its last byte.
+
+        Args:
+            text: words separated by single spaces
+
+        Returns: list of (token, index of the first word, index after the last word)
+        """
+        path = pynini.shortestpath(self.find_tags(pynini.escape(text)), nshortest=1, unique=True)
+        if path.start() == pynini.NO_STATE_ID:
+            raise ValueError(f"No tagging found for: {text}")
+        tagged = bytearray()
+        # output length when the first and the last byte of each word were consumed
+        first, last = [], []
+        in_word = False
+        state = path.start()
+        while path.num_arcs(state):
+            arc = next(iter(path.arcs(state)))
+            if arc.olabel:
+                tagged.append(arc.olabel)
+            if arc.ilabel == ord(" "):
+                in_word = False
+            elif arc.ilabel:
+                if not in_word:
+                    first.append(len(tagged))
+                    last.append(len(tagged))
+                    in_word = True
+                last[-1] = len(tagged)
+            state = arc.nextstate
+        tagged_text = tagged.decode("utf-8")
+        starts = []
+        tokens = parse_tokens(tagged_text, starts)
+        # byte offsets of the tokens in the tagger output
+        offsets = []
+        size = position = 0
+        for start in starts:
+            size += len(tagged_text[position:start].encode("utf-8"))
+            position = start
+            offsets.append(size)
+        spans = [[len(first), 0] for _ in tokens]
+        for word, (begin, end) in enumerate(zip(first, last)):
+            for i in range(max(0, bisect.bisect_right(offsets, begin) - 1), bisect.bisect_right(offsets, end)):
+                spans[i][0] = min(spans[i][0], word)
+                spans[i][1] = max(spans[i][1], word + 1)
+        previous = 0
+        for span in spans:
+            if span[0] > span[1]:
+                # a token consuming no input, e.g. inserted, is given an empty span
+                span[0] = span[1] = previous
+            previous = span[1]
+        return [(token, start, end) for token, (start, end) in zip(tokens, spans)]
+
 
 def parse_args():
     parser = ArgumentParser()
@@ -196,6 +486,12 @@ def parse_args():
         default=None,
         type=str,
     )
+    parser.add_argument(
+        "--bundle_dir",
+        help="path to a grammar bundle created with `viet-itn compile`, grammars are not compiled if set",
+        default=None,
+        type=str,
+    )
     return parser.parse_args()
 
 
@@ -210,6 +506,7 @@ if __name__ == "__main__":
         cache_dir=args.cache_dir,
         overwrite_cache=args.overwrite_cache,
         whitelist=whitelist,
+        bundle_dir=args.bundle_dir,
     )
     print(f'Time to generate graph: {round(perf_counter() - start_time, 2)} sec')
 
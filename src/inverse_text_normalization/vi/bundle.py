@@ -0,0 +1,186 @@
+# Copyright (c) 2021, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+import pynini
+
+from src.inverse_text_normalization.vi.composed import ComposedFst
+from src.inverse_text_normalization.vi.graph_utils import GraphFst, generator_main, get_fingerprint
+from src.inverse_text_normalization.vi.taggers.tokenize_and_classify import ClassifyFst
+from src.inverse_text_normalization.vi.utils import get_abs_path
+from src.inverse_text_normalization.vi.verbalizers.verbalize_final import VerbalizeFinalFst
+from nemo_text_processing.text_normalization.en.graph_utils import INPUT_LOWER_CASED
+from nemo_text_processing.utils.logging import logger
+
+BUNDLE_VERSION = 4
+FAR_FILE = "grammars.far"
+MANIFEST_FILE = "manifest.json"
+
+
+def get_grammar_hash(input_case: str = INPUT_LOWER_CASED, whitelist: str = None) -> str:
+    """
+    Returns fingerprint of all tagger, trigger, verbalizer and composed grammar sources a bundle is compiled from
+
+    Args:
+        input_case: accepting either "lower_cased" or "cased" input.
+        whitelist: path to a file with whitelist replacements
+    """
+    sources = [
+        get_abs_path(x)
+        for x in ["taggers", "verbalizers", "data", "composed.py", "graph_utils.py", "triggers.py", "utils.py"]
+    ]
+    return get_fingerprint(sources + [whitelist], input_case)
+
+
+def _sha256(file_name: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _describe(fst: "pynini.FstLike") -> Dict[str, object]:
+    return {
+        "states": fst.num_states(),
+        "arcs": sum(fst.num_arcs(state) for state in fst.states()),
+        "sha256": hashlib.sha256(fst.write_to_string()).hexdigest(),
+    }
+
+
+def check_field_order(
+    graphs: Dict[str, GraphFst], verbalizer: "pynini.FstLike", n_examples: int = 3
+) -> Dict[str, List[str]]:
+    """
+    Checks that the verbalizer accepts every token of every tagger in the field order the tagger emits it,
+    so it can be verbalized once without trying permutations.
+
+    Args:
+        graphs: class taggers, e.g. `ClassifyFst.graphs`
+        verbalizer: verbalizer of whole sentences, e.g. `VerbalizeFinalFst.fst`
+        n_examples: number of rejected tokens to report per class
+
+    Returns mapping of class names to examples of rejected tokens, only for classes with rejected tokens
+    """
+    accepted = pynini.arcmap(pynini.project(verbalizer, "input"), map_type="rmweight").rmepsilon()
+    accepted = pynini.determinize(accepted).minimize()
+    rejected = {}
+    for name, graph in graphs.items():
+        tagged = pynini.accep("tokens { ") + pynini.project(graph.fst, "output") + pynini.accep(" }")
+        tagged = pynini.arcmap(tagged, map_type="rmweight").rmepsilon()
+        difference = pynini.difference(tagged, accepted).connect()
+        if difference.num_states() != 0:
+            examples = pynini.shortestpath(difference, nshortest=n_examples, unique=True)
+            rejected[name] = sorted(examples.paths().ostrings())
+            logger.warning(f"Field order of {name} is not always accepted by the verbalizer, e.g. {rejected[name][0]}")
+    return rejected
+
+
+def compile_bundle(
+    output_dir: str, input_case: str = INPUT_LOWER_CASED, whitelist: str = None, n_jobs: int = 1
+) -> Dict:
+    """
+    Compiles tagger and verbalizer into a single FAR file next to a manifest.json describing it, e.g.
+        bundle/grammars.far, bundle/manifest.json
+    The manifest lists classes whose field order the verbalizer does not always accept, see `check_field_order`.
+
+    Args:
+        output_dir: bundle directory, created if missing
+        input_case: accepting either "lower_cased" or "cased" input.
+        whitelist: path to a file with whitelist replacements
+        n_jobs: number of processes used to compile sub-grammars
+
+    Returns manifest
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tagger = ClassifyFst(cache_dir=None, whitelist=whitelist, input_case=input_case, n_jobs=n_jobs)
+    verbalizer = VerbalizeFinalFst(cache_dir=None, n_jobs=n_jobs)
+    composed = ComposedFst(tagger, cache_dir=None)
+    graphs = {
+        "tokenize_and_classify": tagger.fst,
+        "triggers": tagger.triggers,
+        "vocabulary": tagger.vocabulary,
+        "verbalize": verbalizer.fst,
+        "tokenize_and_verbalize": composed.fst,
+    }
+
+    far_file = os.path.join(output_dir, FAR_FILE)
+    generator_main(far_file, graphs)
+    rejected = check_field_order(tagger.graphs, verbalizer.fst)
+
+    manifest = {
+        "bundle_version": BUNDLE_VERSION,
+        "grammar_hash": get_grammar_hash(input_case, whitelist),
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "pynini_version": pynini.__version__,
+        "input_case": input_case,
+        "whitelist": os.path.abspath(whitelist) if whitelist else None,
+        "far_file": FAR_FILE,
+        "sha256": _sha256(far_file),
+        "rules": {rule: _describe(graph) for rule, graph in graphs.items()},
+        "field_order_rejected": rejected,
+    }
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    with open(f"{manifest_file}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(f"{manifest_file}.{os.getpid()}.tmp", manifest_file)
+    logger.info(f"Created {manifest_file}")
+    return manifest
+
+
+def load_bundle(bundle_dir: str, composed: bool = False) -> Tuple[GraphFst, GraphFst, Dict]:
+    """
+    Loads a bundle created by `compile_bundle`. Nothing is compiled or written, so the bundle may live on a
+    read-only file system.
+
+    Args:
+        bundle_dir: bundle directory
+        composed: whether to also load the precomposed tagger and verbalizer as `tagger.composed`
+
+    Returns tagger, verbalizer and manifest
+    """
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("bundle_version") != BUNDLE_VERSION:
+        raise ValueError(
+            f"Bundle {bundle_dir} has version {manifest.get('bundle_version')}, expected {BUNDLE_VERSION}. "
+            f"Recompile it with `viet-itn compile`."
+        )
+
+    far_file = os.path.join(bundle_dir, manifest["far_file"])
+    if _sha256(far_file) != manifest["sha256"]:
+        raise ValueError(f"Checksum mismatch for {far_file}, the bundle is corrupted.")
+    if manifest["pynini_version"] != pynini.__version__:
+        logger.warning(f"Bundle {bundle_dir} was compiled with pynini {manifest['pynini_version']}.")
+    if manifest["grammar_hash"] != get_grammar_hash(manifest["input_case"], manifest["whitelist"]):
+        logger.warning(f"Bundle {bundle_dir} was compiled from different grammar sources.")
+
+    far = pynini.Far(far_file, mode="r")
+    tagger = GraphFst(name="tokenize_and_classify", kind="classify")
+    tagger.fst = far["tokenize_and_classify"]
+    tagger.triggers = far["triggers"]
+    tagger.vocabulary = far["vocabulary"]
+    if composed:
+        tagger.composed = ComposedFst.__new__(ComposedFst)
+        GraphFst.__init__(tagger.composed, name="tokenize_and_verbalize", kind="classify")
+        tagger.composed.fst = far["tokenize_and_verbalize"].arcsort(sort_type="ilabel")
+    verbalizer = GraphFst(name="verbalize_final", kind="verbalize")
+    verbalizer.fst = far["verbalize"].arcsort(sort_type="ilabel")
+    logger.info(f"Grammars restored from bundle {bundle_dir} built at {manifest['built_at']}.")
+    return tagger, verbalizer, manifest
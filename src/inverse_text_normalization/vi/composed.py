@@ -0,0 +1,114 @@
+# Copyright (c) 2021, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+
+import pynini
+from pynini.lib import pynutil, rewrite
+
+from src.inverse_text_normalization.vi.graph_utils import (
+    NEMO_WHITE_SPACE,
+    GraphFst,
+    delete_space,
+    generator_main,
+    get_fingerprint,
+    remove_stale_fars,
+)
+from src.inverse_text_normalization.vi.verbalizers.verbalize import VerbalizeFst
+from src.inverse_text_normalization.vi.verbalizers.word import WordFst
+from nemo_text_processing.utils.logging import logger
+
+# output of sentences whose best tagging has a token the verbalizer rejects in tagger field order
+FALLBACK = "\uE000"
+# written forms whose weights differ by less are a tie
+TIE = 1e-4
+
+
+class ComposedFst(GraphFst):
+    """
+    Finite state transducer that rewrites spoken sentences to written form in a single pass, the tagger composed
+    with the verbalizer, e.g.
+        một triệu đồng -> 1000000₫
+
+    Verbalizers carry no weights, so the shortest path has the weight of the best tagging. Where two taggings with
+    different written forms tie, shortestpath may pick another one than on the tagger alone, such sentences are
+    rewritten to `FALLBACK` to leave the choice to the tagger. So are sentences whose best tagging contains a token
+    the verbalizer only accepts in another field order (see `check_field_order`), these need the permutation pipeline.
+
+    Args:
+        tagger: ClassifyFst
+        cache_dir: path to a dir with .far grammar file. Set to None to avoid using cache.
+            The file name carries a fingerprint of the tagger and the verbalizer sources.
+        overwrite_cache: set to True to overwrite .far files
+    """
+
+    def __init__(self, tagger: GraphFst, cache_dir: str = None, overwrite_cache: bool = False):
+        super().__init__(name="tokenize_and_verbalize", kind="classify")
+
+        far_file = None
+        if cache_dir and cache_dir != "None":
+            # composition may arc-sort the tagger, hash it in sorted form
+            tagger_hash = hashlib.sha256(tagger.fst.copy().arcsort(sort_type="ilabel").write_to_string()).hexdigest()
+            sources = [os.path.abspath(__file__), os.path.join(os.path.dirname(__file__), "verbalizers")]
+            fingerprint = get_fingerprint(sources, tagger_hash)
+            far_file = os.path.join(cache_dir, f"vi_itn_composed_{fingerprint[:16]}.far")
+
+        if not overwrite_cache and far_file and os.path.exists(far_file):
+            self.fst = pynini.Far(far_file, mode="r")["tokenize_and_verbalize"]
+            logger.info(f"ComposedFst.fst restored from {far_file}.")
+        else:
+            logger.info("Composing tagger and verbalizer.")
+            types = VerbalizeFst(cache_dir=cache_dir).fst | WordFst.cached(cache_dir=cache_dir).fst
+            token = (
+                pynutil.delete("tokens")
+                + delete_space
+                + pynutil.delete("{")
+                + delete_space
+                + types
+                + delete_space
+                + pynutil.delete("}")
+            )
+            # the tagger does not put a space between punctuation and neighbouring tokens
+            separator = pynini.cross(pynini.closure(NEMO_WHITE_SPACE), " ")
+            verbalizer = (delete_space + token + pynini.closure(separator + token) + delete_space).optimize()
+
+            classify = tagger.fst.copy()
+            tagged = pynini.arcmap(pynini.project(classify, "output"), map_type="rmweight").rmepsilon()
+            accepted = pynini.arcmap(pynini.project(verbalizer, "input"), map_type="rmweight").rmepsilon()
+            rejected = pynini.difference(tagged, pynini.determinize(accepted).minimize())
+
+            verbalized = pynini.compose(classify, verbalizer.arcsort(sort_type="ilabel"))
+            fallback = pynini.project(pynini.compose(classify, rejected), "input") + pynutil.insert(FALLBACK)
+            self.fst = (verbalized | fallback).optimize()
+
+            if far_file:
+                generator_main(far_file, {"tokenize_and_verbalize": self.fst})
+                remove_stale_fars(far_file)
+
+        self.fst.arcsort(sort_type="ilabel")
+
+    def rewrite(self, text: str) -> str:
+        """
+        Returns written form of `text`, `FALLBACK` if it needs the permutation pipeline
+        """
+        text = text.strip()
+        if not text:
+            return text
+        lattice = pynini.project(rewrite.rewrite_lattice(pynini.escape(text), self.fst), "output").rmepsilon()
+        paths = pynini.shortestpath(lattice, nshortest=2, unique=True).paths()
+        best = sorted((float(weight), output) for _, output, weight in paths.items())
+        if len(best) > 1 and best[1][0] - best[0][0] < TIE:
+            return FALLBACK
+        return best[0][1]
@@ -13,16 +13,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
+import re
 import string
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Tuple
 
 import pynini
 from pynini import Far
 from pynini.export import export
 from pynini.lib import byte, pynutil, utf8
 
+from src.inverse_text_normalization.vi.utils import get_abs_path
 from nemo_text_processing.utils.logging import logger
 
 NEMO_CHAR = utf8.VALID_UTF8_CHAR
@@ -56,21 +61,80 @@ TO_LOWER = pynini.union(*[pynini.cross(x, y) for x, y in zip(string.ascii_upperc
 TO_UPPER = pynini.invert(TO_LOWER)
 
 
-def generator_main(file_name: str, graphs: Dict[str, pynini.FstLike]):
+def generator_main(file_name: str, graphs: Dict[str, pynini.FstLike], optimize: bool = True):
     """
     Exports graph as OpenFst finite state archive (FAR) file with given file name and rule name.
 
     Args:
         file_name: exported file name
         graphs: Mapping of a rule name and Pynini WFST graph to be exported
+        optimize: whether to optimize graphs before export
     """
-    exporter = export.Exporter(file_name)
+    # write next to the target and rename, so concurrent readers never see a partially written archive
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    tmp_file = f"{file_name}.{os.getpid()}.tmp"
+    exporter = export.Exporter(tmp_file)
     for rule, graph in graphs.items():
-        exporter[rule] = graph.optimize()
+        exporter[rule] = graph.optimize() if optimize else graph
     exporter.close()
+    os.replace(tmp_file, file_name)
     logger.info(f"Created {file_name}")
 
 
+def remove_stale_fars(far_file: str):
+    """
+    Removes .far files next to `far_file` that differ from it only in their fingerprint, i.e. `<name>_<fingerprint>.far`
+    files compiled from earlier grammar sources, which would otherwise pile up in the cache.
+
+    Args:
+        far_file: path of the .far file just written
+    """
+    directory, name = os.path.split(os.path.abspath(far_file))
+    stale = re.compile(re.escape(name.rsplit("_", 1)[0]) + r"_[0-9a-f]{16}\.far")
+    for x in os.listdir(directory):
+        if x != name and stale.fullmatch(x):
+            try:
+                os.remove(os.path.join(directory, x))
+            except FileNotFoundError:
+                # removed by another process writing the same grammar
+                continue
+            logger.info(f"Removed stale {os.path.join(directory, x)}")
+
+
+def get_fingerprint(paths: List[str], *extra: str) -> str:
+    """
+    Computes a content hash of grammar sources, used to key cached .far files.
+    Directories are walked recursively for .py and .tsv files. The pynini version is always included,
+    since compiled FSTs are not guaranteed to be portable across versions.
+
+    Args:
+        paths: files or directories the grammar is built from
+        extra: additional build parameters that change the resulting grammar, e.g. input case
+
+    Returns hex digest
+    """
+    files = set()
+    for path in paths:
+        if path and os.path.isdir(path):
+            parent = os.path.dirname(os.path.normpath(path))
+            for root, _, names in os.walk(path):
+                for x in names:
+                    if x.endswith((".py", ".tsv")):
+                        file_name = os.path.join(root, x)
+                        files.add((os.path.relpath(file_name, parent), file_name))
+        elif path and os.path.exists(path):
+            files.add((os.path.basename(path), os.path.abspath(path)))
+
+    digest = hashlib.sha256(pynini.__version__.encode())
+    for key, file_name in sorted(files):
+        digest.update(key.encode())
+        with open(file_name, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    for x in extra:
+        digest.update(str(x).encode())
+    return digest.hexdigest()
+
+
 def convert_space(fst) -> "pynini.FstLike":
     """
     Converts space to nonbreaking space.
@@ -85,6 +149,70 @@ def convert_space(fst) -> "pynini.FstLike":
     return fst @ pynini.cdrewrite(pynini.cross(NEMO_SPACE, NEMO_NON_BREAKING_SPACE), "", "", NEMO_SIGMA)
 
 
+def _build_graph(cls: type, cache_dir: str, overwrite_cache: bool, kwargs: Dict) -> "GraphFst":
+    return cls.cached(cache_dir, overwrite_cache=overwrite_cache, **kwargs)
+
+
+def build_graphs(
+    specs: Dict[str, Tuple[type, Tuple[str, ...], Dict]],
+    cache_dir: str = None,
+    overwrite_cache: bool = False,
+    n_jobs: int = 1,
+) -> Dict[str, "GraphFst"]:
+    """
+    Builds grammars in dependency order, see `GraphFst.cached` for caching.
+    With n_jobs > 1 every grammar whose dependencies are ready is compiled in a process pool
+    and sent back pickled, i.e. as serialized FSTs. The pool lives for one call, so grammars built by separate
+    calls, such as the tagger's and the verbalizer's, do not overlap.
+
+    Args:
+        specs: mapping of a name to grammar class, names of the grammars it depends on and other keyword arguments,
+            e.g. {"cardinal": (CardinalFst, (), {}), "decimal": (DecimalFst, ("cardinal",), {})}.
+            Dependencies are passed as keyword arguments named after them.
+        cache_dir: path to a dir with .far grammar files. Set to None to avoid using cache.
+        overwrite_cache: set to True to overwrite .far files
+        n_jobs: number of processes, 1 builds everything in the current process,
+            negative values count back from the number of CPUs as in joblib: -1 uses all of them
+
+    Returns mapping of a name to grammar
+    """
+    if n_jobs == 0:
+        raise ValueError("n_jobs == 0 has no meaning, use 1 to build in the current process")
+    if n_jobs < 0:
+        n_jobs = max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    graphs = {}
+    pending = dict(specs)
+
+    def _pop_ready() -> List[Tuple[str, type, Dict]]:
+        ready = []
+        for name, (cls, deps, kwargs) in list(pending.items()):
+            if all(x in graphs for x in deps):
+                del pending[name]
+                ready.append((name, cls, {**kwargs, **{x: graphs[x] for x in deps}}))
+        return ready
+
+    if n_jobs == 1:
+        while pending:
+            ready = _pop_ready()
+            if not ready:
+                raise ValueError(f"Unresolvable grammar dependencies: {sorted(pending)}")
+            for name, cls, kwargs in ready:
+                graphs[name] = _build_graph(cls, cache_dir, overwrite_cache, kwargs)
+        return graphs
+
+    running = {}
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        while pending or running:
+            for name, cls, kwargs in _pop_ready():
+                running[executor.submit(_build_graph, cls, cache_dir, overwrite_cache, kwargs)] = name
+            if not running:
+                raise ValueError(f"Unresolvable grammar dependencies: {sorted(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                graphs[running.pop(future)] = future.result()
+    return graphs
+
+
 class GraphFst:
     """
     Base class for all grammar fsts.
@@ -106,6 +234,80 @@ class GraphFst:
         if self.far_exist():
             self._fst = Far(self.far_path, mode="r", arc_type="standard", far_type="default").get_fst()
 
+    @classmethod
+    def cached(cls, cache_dir: str, *args, overwrite_cache: bool = False, **kwargs) -> "GraphFst":
+        """
+        Creates grammar, restoring it from `cache_dir` if a .far file with a matching dependency fingerprint exists,
+        see `get_dependency_fingerprint`. All FST attributes are stored, e.g. CardinalFst.graph_no_exception,
+        so restored grammars can be passed on to grammars depending on them.
+
+        Args:
+            cache_dir: path to a dir with .far grammar files. Set to None to avoid using cache.
+            overwrite_cache: set to True to overwrite .far files
+            args: grammar arguments
+            kwargs: grammar keyword arguments
+
+        Returns grammar with its `fingerprint` set
+        """
+        fingerprint = cls.get_dependency_fingerprint(*args, **kwargs)
+        if not cache_dir or cache_dir == "None" or fingerprint is None:
+            return cls(*args, **kwargs)
+
+        package = cls.__module__.split(".")[-2]
+        far_file = os.path.join(cache_dir, package, f"{cls.__name__}_{fingerprint[:16]}.far")
+        if not overwrite_cache and os.path.exists(far_file):
+            graph = cls.__new__(cls)
+            far = Far(far_file, mode="r")
+            while not far.done():
+                kind, name, attr = far.get_key().split(".")
+                if attr == "fst":
+                    GraphFst.__init__(graph, name=name, kind=kind)
+                setattr(graph, attr, far.get_fst())
+                far.next()
+            logger.debug(f"{cls.__name__} restored from {far_file}.")
+        else:
+            graph = cls(*args, **kwargs)
+            graphs = {
+                f"{graph.kind}.{graph.name}.{attr.lstrip('_')}": fst
+                for attr, fst in vars(graph).items()
+                if isinstance(fst, pynini.Fst)
+            }
+            generator_main(far_file, graphs, optimize=False)
+            remove_stale_fars(far_file)
+        graph.fingerprint = fingerprint
+        return graph
+
+    @classmethod
+    def get_dependency_fingerprint(cls, *args, **kwargs) -> str:
+        """
+        Computes fingerprint of everything the grammar is built from: the module defining the class,
+        data files it references with get_abs_path, graph_utils.py, utils.py, and its arguments.
+        Grammar arguments contribute their own fingerprint, file paths their content.
+
+        Args:
+            args: grammar arguments
+            kwargs: grammar keyword arguments
+
+        Returns hex digest or None if some argument can not be fingerprinted
+        """
+        module_file = sys.modules[cls.__module__].__file__
+        with open(module_file, encoding="utf-8") as f:
+            data_files = re.findall(r'get_abs_path\(\s*"([^"]+)"\s*\)', f.read())
+        sources = [module_file, __file__, get_abs_path("utils.py")] + [get_abs_path(x) for x in data_files]
+
+        extra = [cls.__module__, cls.__name__]
+        for key, value in [(None, x) for x in args] + sorted(kwargs.items()):
+            if isinstance(value, GraphFst):
+                value = getattr(value, "fingerprint", None)
+                if value is None:
+                    return None
+            elif isinstance(value, str) and os.path.isfile(value):
+                value = get_fingerprint([value])
+            elif not isinstance(value, (str, int, float, bool, type(None))):
+                return None
+            extra.append(f"{key}={value}")
+        return get_fingerprint(sources, *extra)
+
     def far_exist(self) -> bool:
         """
         Returns true if FAR can be loaded
@@ -21,10 +21,13 @@ from pynini.lib import pynutil
 from src.inverse_text_normalization.vi.graph_utils import (
     NEMO_DIGIT,
     GraphFst,
+    build_graphs,
     convert_space,
     delete_extra_space,
     delete_space,
     generator_main,
+    get_fingerprint,
+    remove_stale_fars,
 )
 from src.inverse_text_normalization.vi.utils import get_abs_path
 from src.inverse_text_normalization.vi.taggers.cardinal import CardinalFst
@@ -40,6 +43,7 @@ from src.inverse_text_normalization.vi.taggers.telephone import TelephoneFst
 from src.inverse_text_normalization.vi.taggers.time import TimeFst
 from src.inverse_text_normalization.vi.taggers.whitelist import WhiteListFst
 from src.inverse_text_normalization.vi.taggers.word import WordFst
+from src.inverse_text_normalization.vi.triggers import get_trigger_fst, get_vocabulary_fst
 from nemo_text_processing.text_normalization.en.graph_utils import INPUT_LOWER_CASED
 from nemo_text_processing.utils.logging import logger
 
@@ -48,6 +52,19 @@ class ClassifyFst(GraphFst):
     """
     Composite FST that tokenizes and classifies entire sentences.
     Uses updated CardinalFst, MoneyFst, DecimalFst with quantity support.
+
+    Args:
+        cache_dir: path to a dir with .far grammar file. Set to None to avoid using cache.
+            The file name carries a fingerprint of the tagger sources, data files, whitelist, input case
+            and pynini version, so a stale grammar is never restored.
+        overwrite_cache: set to True to overwrite .far files
+        whitelist: path to a file with whitelist replacements
+        input_case: accepting either "lower_cased" or "cased" input.
+        n_jobs: number of processes used to compile sub-grammars, independent ones are built in parallel
+
+    Besides `fst`, `triggers` and `vocabulary` hold acceptors of the words a semiotic token can start with
+    and can contain, see `TriggerIndex`. If the grammars were built rather than restored from cache,
+    `graphs` maps class names to their taggers.
     """
 
     def __init__(
@@ -56,51 +73,68 @@ class ClassifyFst(GraphFst):
         overwrite_cache: bool = False,
         whitelist: str = None,
         input_case: str = INPUT_LOWER_CASED,
+        n_jobs: int = 1,
     ):
         super().__init__(name="tokenize_and_classify", kind="classify")
 
         far_file = None
+        self.graphs = None
         if cache_dir and cache_dir != "None":
             os.makedirs(cache_dir, exist_ok=True)
-            far_file = os.path.join(cache_dir, f"vi_itn_{input_case}.far")
+            sources = [get_abs_path(x) for x in ["taggers", "data", "graph_utils.py", "triggers.py", "utils.py"]]
+            fingerprint = get_fingerprint(sources + [whitelist], input_case)
+            far_file = os.path.join(cache_dir, f"vi_itn_{input_case}_{fingerprint[:16]}.far")
 
         if not overwrite_cache and far_file and os.path.exists(far_file):
-            self.fst = pynini.Far(far_file, mode="r")["tokenize_and_classify"]
+            far = pynini.Far(far_file, mode="r")
+            self.fst = far["tokenize_and_classify"]
+            self.triggers = far["triggers"]
+            self.vocabulary = far["vocabulary"]
             logger.info(f"ClassifyFst.fst restored from {far_file}.")
         else:
             logger.info("Creating updated ClassifyFst grammars.")
-            # Instantiate tagging FSTs
-            cardinal = CardinalFst()
-            fraction = FractionFst(cardinal)
-            ordinal = OrdinalFst()
-            decimal = DecimalFst(cardinal)
-            measure = MeasureFst(cardinal=cardinal, decimal=decimal)
-            date = DateFst(cardinal=cardinal)
-            word = WordFst()
-            time = TimeFst()
-            money = MoneyFst(cardinal=cardinal, decimal=decimal)
-            whitelist_fst = WhiteListFst(input_file=whitelist)
-            punct = PunctuationFst()
-            electronic = ElectronicFst()
-            telephone = TelephoneFst()
+            # Instantiate tagging FSTs, each one is restored from its own .far file if its dependencies are unchanged
+            graphs = self.graphs = build_graphs(
+                {
+                    "cardinal": (CardinalFst, (), {}),
+                    "fraction": (FractionFst, ("cardinal",), {}),
+                    "ordinal": (OrdinalFst, (), {}),
+                    "decimal": (DecimalFst, ("cardinal",), {}),
+                    "measure": (MeasureFst, ("cardinal", "decimal"), {}),
+                    "date": (DateFst, ("cardinal",), {}),
+                    "word": (WordFst, (), {}),
+                    "time": (TimeFst, (), {}),
+                    "money": (MoneyFst, ("cardinal", "decimal"), {}),
+                    "whitelist": (WhiteListFst, (), {"input_file": whitelist}),
+                    "punct": (PunctuationFst, (), {}),
+                    "electronic": (ElectronicFst, (), {}),
+                    "telephone": (TelephoneFst, (), {}),
+                },
+                cache_dir=cache_dir,
+                overwrite_cache=overwrite_cache,
+                n_jobs=n_jobs,
+            )
 
             # Collect weighted unions
-            classify = (
-                pynutil.add_weight(whitelist_fst.fst, 1.01)
-                | pynutil.add_weight(time.fst, 1.05)
-                | pynutil.add_weight(money.fst, 1.03)
-                | pynutil.add_weight(telephone.fst, 1.04)
-                | pynutil.add_weight(date.fst, 1.09)
-                | pynutil.add_weight(decimal.fst, 1.08)
-                | pynutil.add_weight(measure.fst, 1.1)
-                | pynutil.add_weight(cardinal.fst, 1.1)
-                | pynutil.add_weight(ordinal.fst, 1.1)
-                | pynutil.add_weight(fraction.fst, 1.09)
-                | pynutil.add_weight(electronic.fst, 1.1)
-                | pynutil.add_weight(word.fst, 100)
+            semiotic = (
+                pynutil.add_weight(graphs["whitelist"].fst, 1.01)
+                | pynutil.add_weight(graphs["time"].fst, 1.05)
+                | pynutil.add_weight(graphs["money"].fst, 1.03)
+                | pynutil.add_weight(graphs["telephone"].fst, 1.04)
+                | pynutil.add_weight(graphs["date"].fst, 1.09)
+                | pynutil.add_weight(graphs["decimal"].fst, 1.08)
+                | pynutil.add_weight(graphs["measure"].fst, 1.1)
+                | pynutil.add_weight(graphs["cardinal"].fst, 1.1)
+                | pynutil.add_weight(graphs["ordinal"].fst, 1.1)
+                | pynutil.add_weight(graphs["fraction"].fst, 1.09)
+                | pynutil.add_weight(graphs["electronic"].fst, 1.1)
             )
+            classify = semiotic | pynutil.add_weight(graphs["word"].fst, 100)
+            self.triggers = get_trigger_fst(semiotic)
+            self.vocabulary = get_vocabulary_fst(semiotic)
 
-            punct_graph = pynutil.insert("tokens { ") + pynutil.add_weight(punct.fst, 1.1) + pynutil.insert(" }")
+            punct = pynutil.add_weight(graphs["punct"].fst, 1.1)
+            punct_graph = pynutil.insert("tokens { ") + punct + pynutil.insert(" }")
             token_graph = pynutil.insert("tokens { ") + classify + pynutil.insert(" }")
             token_plus_punct = (
                 pynini.closure(punct_graph + delete_space)
@@ -115,4 +149,8 @@ class ClassifyFst(GraphFst):
 
             # Write FAR cache if requested
             if far_file:
-                generator_main(far_file, {"tokenize_and_classify": self.fst})
\ No newline at end of file
+                generator_main(
+                    far_file,
+                    {"tokenize_and_classify": self.fst, "triggers": self.triggers, "vocabulary": self.vocabulary},
+                )
+                remove_stale_fars(far_file)
@@ -0,0 +1,100 @@
+# Copyright (c) 2021, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import re
+from typing import Iterator, List, Optional, Tuple, Union
+
+from nemo_text_processing.text_normalization.token_parser import PRESERVE_ORDER_KEY
+
+# A record is a (key, value) pair, the value is a string, True for `preserve_order: true`
+# or a tuple of nested records. A token is the tuple of records inside `tokens { ... }`, e.g.
+#     tokens { money { integer_part: "12" currency: "$" } }
+#         -> (("money", (("integer_part", "12"), ("currency", "$"))),)
+#     tokens { name: "xin" } -> (("name", "xin"),)
+Record = Tuple[str, Union[str, bool, tuple]]
+Token = Tuple[Record, ...]
+
+# a value ends with a quote followed by space, like in TokenParser
+_FIELD = re.compile(r' *(?:([A-Za-z_]+) *(?:(\{)|: *(?:"(.*?)"(?= )|(true)))|(\}))')
+
+
+def parse_tokens(tagged_text: str, starts: Optional[List[int]] = None) -> List[Token]:
+    """
+    Parses tagged text in a single pass into tokens.
+    Equivalent to TokenParser, but returns immutable (hashable) records instead of nested dictionaries.
+
+    Args:
+        tagged_text: shortest path of the tagger lattice
+        starts: if given, the offset in `tagged_text` where each token starts is appended to it
+
+    Returns list of tokens
+    """
+    stack = [[]]
+    position = 0
+    end = len(tagged_text.rstrip(" "))
+    while position < end:
+        match = _FIELD.match(tagged_text, position)
+        if match is None:
+            raise ValueError(f"Can not parse tagged text at {position}: {tagged_text}")
+        key, group, value, true, close = match.groups()
+        if group:
+            if starts is not None and len(stack) == 1:
+                starts.append(match.start(1))
+            stack.append([key])
+        elif close:
+            fields = stack.pop()
+            stack[-1].append((fields[0], tuple(fields[1:])))
+        else:
+            stack[-1].append((key, True if true else value))
+        position = match.end()
+    if len(stack) != 1:
+        raise ValueError(f"Unbalanced braces in tagged text: {tagged_text}")
+    return [token for _, token in stack[0]]
+
+
+def plain_text(token: Token) -> Optional[str]:
+    """
+    Returns written form of a plain word or punctuation token, i.e. what WordFst and WhiteListFst verbalize
+    `tokens { name: "..." }` to, or None for semiotic tokens that need the verbalizer.
+    """
+    if len(token) == 1 and token[0][0] == "name" and isinstance(token[0][1], str):
+        return token[0][1].replace("\u00A0", " ")
+    return None
+
+
+def permutations(token: Token) -> Iterator[str]:
+    """
+    Lazily serializes a token for the verbalizer, the first string keeps the tagger field order.
+    Yields the same strings in the same order as `Normalizer.generate_permutations` for a single token.
+    """
+    return _permute((("tokens", token),))
+
+
+def _permute(fields: tuple) -> Iterator[str]:
+    if any(key == PRESERVE_ORDER_KEY for key, _ in fields):
+        orders = [fields]
+    else:
+        orders = itertools.permutations(fields)
+    for order in orders:
+        parts = []
+        for key, value in order:
+            if value is True:
+                parts.append([f"{key}: true "])
+            elif isinstance(value, str):
+                parts.append([f"{key}: \"{value}\" "])
+            else:
+                parts.append([f" {key} {{ {nested} }} " for nested in _permute(value)])
+        for option in itertools.product(*parts):
+            yield "".join(option)
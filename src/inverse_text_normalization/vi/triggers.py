@@ -0,0 +1,196 @@
+# Copyright (c) 2021, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from typing import List, Tuple
+
+import pynini
+from pynini.lib import pynutil
+
+from src.inverse_text_normalization.vi.graph_utils import NEMO_NOT_SPACE, NEMO_SIGMA, NEMO_WHITE_SPACE, delete_space
+
+# characters PunctuationFst splits off a token, and white space as seen by the tagger
+PUNCTUATION = "!#$%&'()*+,-./:;<=>?@^_`{|}~"
+WHITE_SPACE = re.compile("[ \t\n\r\u00A0]+")
+# a word made only of punctuation marks, which the tagger splits into one token per mark
+PUNCTUATION_RUN = re.compile(f"(?<!\\S)[{re.escape(PUNCTUATION)}]{{2,}}(?!\\S)")
+PUNCTUATION_ONLY = re.compile(f"\\s*[{re.escape(PUNCTUATION)}][{re.escape(PUNCTUATION)}\\s]*")
+SENTENCE_END = (".", "!", "?", ";", "…")
+
+
+def _project_words(graph: "pynini.FstLike", words: "pynini.FstLike") -> "pynini.Fst":
+    spoken = pynini.arcmap(pynini.project(graph, "input"), map_type="rmweight").rmepsilon()
+    return pynini.determinize(pynini.project(spoken @ words, "output").rmepsilon()).minimize()
+
+
+def get_trigger_fst(graph: "pynini.FstLike") -> "pynini.Fst":
+    """
+    Returns deterministic acceptor of all words a token accepted by `graph` can start with,
+    e.g. for CardinalFst: "một", "hai", "mười", ...
+
+    Args:
+        graph: tagger of semiotic classes (without WordFst and PunctuationFst)
+    """
+    first_word = delete_space + pynini.closure(NEMO_NOT_SPACE, 1) + pynini.closure(
+        pynutil.delete(NEMO_WHITE_SPACE + NEMO_SIGMA), 0, 1
+    )
+    return _project_words(graph, first_word)
+
+
+def get_vocabulary_fst(graph: "pynini.FstLike") -> "pynini.Fst":
+    """
+    Returns deterministic acceptor of all words occurring anywhere in a token accepted by `graph`,
+    e.g. for MoneyFst: "một", "triệu", "đồng", ...
+
+    Args:
+        graph: tagger of semiotic classes (without WordFst and PunctuationFst)
+    """
+    any_word = (
+        pynini.closure(pynutil.delete(NEMO_SIGMA + NEMO_WHITE_SPACE), 0, 1)
+        + delete_space
+        + pynini.closure(NEMO_NOT_SPACE, 1)
+        + pynini.closure(pynutil.delete(NEMO_WHITE_SPACE + NEMO_SIGMA), 0, 1)
+    )
+    return _project_words(graph, any_word)
+
+
+class _Acceptor:
+    def __init__(self, fst: "pynini.Fst"):
+        zero = pynini.Weight.zero(fst.weight_type())
+        self.start = fst.start()
+        self.arcs = [{arc.ilabel: arc.nextstate for arc in fst.arcs(state)} for state in fst.states()]
+        self.finals = {state for state in fst.states() if fst.final(state) != zero}
+
+    def __contains__(self, word: str) -> bool:
+        state = self.start
+        for label in word.encode("utf-8"):
+            state = self.arcs[state].get(label)
+            if state is None:
+                return False
+        return state in self.finals
+
+
+class TriggerIndex:
+    """
+    Lexicon of the semiotic classes, used to decide with a single scan over the words of a sentence
+        - whether any word can start a semiotic token. If none can, the tagger would classify every word as plain
+          or punctuation and the sentence is returned as `passthrough` writes it.
+        - where a semiotic token can not span two neighbouring words. Text on both sides of such a boundary
+          is tagged and verbalized independently with the same result, see `segments`.
+
+    Args:
+        triggers: acceptor created with `get_trigger_fst`
+        vocabulary: acceptor created with `get_vocabulary_fst`
+    """
+
+    def __init__(self, triggers: "pynini.Fst", vocabulary: "pynini.Fst"):
+        self.triggers = _Acceptor(triggers)
+        self.vocabulary = _Acceptor(vocabulary)
+
+    @staticmethod
+    def _spans(token: str, strip_start: bool, strip_end: bool):
+        # parts of a white space delimited word a semiotic token can cover, after PunctuationFst split off
+        # any number of punctuation marks from its start and end
+        start = len(token) - len(token.lstrip(PUNCTUATION)) if strip_start else 0
+        end = len(token.rstrip(PUNCTUATION)) if strip_end else len(token)
+        for i in range(start + 1):
+            for j in range(max(end, i + 1), len(token) + 1):
+                yield token[i:j]
+
+    def is_trigger(self, token: str) -> bool:
+        """
+        Returns True if a semiotic token can start in `token`, a white space delimited word of escaped input
+        """
+        return any(span in self.triggers for span in self._spans(token, True, True))
+
+    def is_boundary(self, left: str, right: str) -> bool:
+        """
+        Returns True if no semiotic token can span the white space between escaped words `left` and `right`
+        """
+        return not (
+            any(span in self.vocabulary for span in self._spans(left, True, False))
+            and any(span in self.vocabulary for span in self._spans(right, False, True))
+        )
+
+    def search(self, text: str) -> bool:
+        """
+        Returns True if any word of `text` is a trigger
+        """
+        return any(self.is_trigger(token) for token in WHITE_SPACE.split(pynini.escape(text)) if token)
+
+    def segments(self, text: str) -> List[Tuple[str, bool]]:
+        """
+        Splits `text` at every boundary no semiotic token can span.
+
+        Returns list of segments with white space collapsed, each with a flag whether it contains a trigger
+        """
+        words = WHITE_SPACE.split(text.strip())
+        if words == [""]:
+            return []
+        escaped = [pynini.escape(word) for word in words]
+        segments = []
+        start = 0
+        trigger = False
+        for i, word in enumerate(escaped):
+            trigger = trigger or self.is_trigger(word)
+            if i + 1 == len(escaped) or self.is_boundary(word, escaped[i + 1]):
+                segments.append((" ".join(words[start : i + 1]), trigger))
+                start = i + 1
+                trigger = False
+        return segments
+
+    def chunks(self, text: str, max_words: int) -> List[Tuple[str, bool]]:
+        """
+        Packs the segments of `text` into chunks of at most `max_words` words, cutting after the last sentence end
+        (".", "!", "?", ";", "…") of a full chunk if it has one. A single segment longer than `max_words` can not be
+        split and becomes a chunk of its own.
+
+        Returns list of chunks with white space collapsed, each with a flag whether it contains a trigger
+        """
+        chunks = []
+        current = []
+        words = 0
+        last_end = 0
+        for segment, trigger in self.segments(text):
+            length = segment.count(" ") + 1
+            while current and words + length > max_words:
+                cut = last_end or len(current)
+                chunks.append((" ".join(s for s, _ in current[:cut]), any(t for _, t in current[:cut])))
+                current = current[cut:]
+                words = sum(s.count(" ") + 1 for s, _ in current)
+                last_end = 0
+            current.append((segment, trigger))
+            words += length
+            if segment.endswith(SENTENCE_END):
+                last_end = len(current)
+        if current:
+            chunks.append((" ".join(s for s, _ in current), any(t for _, t in current)))
+        return chunks
+
+    @staticmethod
+    def punctuation_only(text: str) -> bool:
+        """
+        Returns True if every word of `text` is made only of punctuation marks. The tagger then keeps one of them
+        whole, which one is up to its tie-break, so such text can not be written by `passthrough`
+        """
+        return PUNCTUATION_ONLY.fullmatch(text) is not None
+
+    @staticmethod
+    def passthrough(text: str) -> str:
+        """
+        Returns `text` as the full pipeline returns a sentence without semiotic tokens: stripped with white space
+        collapsed and words made only of punctuation split into single marks, e.g. đi ... về -> đi . . . về.
+        The tagger attaches the marks to the token of a neighbouring word, see `punctuation_only` for text without one.
+        """
+        return PUNCTUATION_RUN.sub(lambda match: " ".join(match.group()), WHITE_SPACE.sub(" ", text.strip()))
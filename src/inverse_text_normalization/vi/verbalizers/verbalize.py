@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from src.inverse_text_normalization.vi.graph_utils import GraphFst
+from src.inverse_text_normalization.vi.graph_utils import GraphFst, build_graphs
 from src.inverse_text_normalization.vi.verbalizers.cardinal import CardinalFst
 from src.inverse_text_normalization.vi.verbalizers.date import DateFst
 from src.inverse_text_normalization.vi.verbalizers.decimal import DecimalFst
@@ -32,35 +32,45 @@ class VerbalizeFst(GraphFst):
     Composes other verbalizer grammars.
     For deployment, this grammar will be compiled and exported to OpenFst Finite State Archive (FAR) File.
     More details to deployment at NeMo/tools/text_processing_deployment.
+
+    Args:
+        cache_dir: path to a dir with .far grammar files, each verbalizer is cached separately.
+            Set to None to avoid using cache.
+        overwrite_cache: set to True to overwrite .far files
+        n_jobs: number of processes used to compile verbalizers
     """
 
-    def __init__(self):
+    def __init__(self, cache_dir: str = None, overwrite_cache: bool = False, n_jobs: int = 1):
         super().__init__(name="verbalize", kind="verbalize")
-        cardinal = CardinalFst()
-        cardinal_graph = cardinal.fst
-        ordinal_graph = OrdinalFst().fst
-        decimal = DecimalFst()
-        decimal_graph = decimal.fst
-        fraction = FractionFst()
-        fraction_graph = fraction.fst
-        measure_graph = MeasureFst(decimal=decimal, cardinal=cardinal).fst
-        money_graph = MoneyFst(decimal=decimal).fst
-        time_graph = TimeFst().fst
-        date_graph = DateFst().fst
-        whitelist_graph = WhiteListFst().fst
-        telephone_graph = TelephoneFst().fst
-        electronic_graph = ElectronicFst().fst
+        graphs = build_graphs(
+            {
+                "cardinal": (CardinalFst, (), {}),
+                "ordinal": (OrdinalFst, (), {}),
+                "decimal": (DecimalFst, (), {}),
+                "fraction": (FractionFst, (), {}),
+                "measure": (MeasureFst, ("decimal", "cardinal"), {}),
+                "money": (MoneyFst, ("decimal",), {}),
+                "time": (TimeFst, (), {}),
+                "date": (DateFst, (), {}),
+                "whitelist": (WhiteListFst, (), {}),
+                "telephone": (TelephoneFst, (), {}),
+                "electronic": (ElectronicFst, (), {}),
+            },
+            cache_dir=cache_dir,
+            overwrite_cache=overwrite_cache,
+            n_jobs=n_jobs,
+        )
         graph = (
-            time_graph
-            | date_graph
-            | money_graph
-            | measure_graph
-            | ordinal_graph
-            | fraction_graph
-            | decimal_graph
-            | cardinal_graph
-            | whitelist_graph
-            | telephone_graph
-            | electronic_graph
+            graphs["time"].fst
+            | graphs["date"].fst
+            | graphs["money"].fst
+            | graphs["measure"].fst
+            | graphs["ordinal"].fst
+            | graphs["fraction"].fst
+            | graphs["decimal"].fst
+            | graphs["cardinal"].fst
+            | graphs["whitelist"].fst
+            | graphs["telephone"].fst
+            | graphs["electronic"].fst
         )
         self.fst = graph
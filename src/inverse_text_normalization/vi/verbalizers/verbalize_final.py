@@ -13,33 +13,69 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
 import pynini
 from pynini.lib import pynutil
 
-from src.inverse_text_normalization.vi.graph_utils import GraphFst, delete_extra_space, delete_space
+from src.inverse_text_normalization.vi.graph_utils import (
+    GraphFst,
+    delete_extra_space,
+    delete_space,
+    generator_main,
+    get_fingerprint,
+    remove_stale_fars,
+)
+from src.inverse_text_normalization.vi.utils import get_abs_path
 from src.inverse_text_normalization.vi.verbalizers.verbalize import VerbalizeFst
 from src.inverse_text_normalization.vi.verbalizers.word import WordFst
+from nemo_text_processing.utils.logging import logger
 
 
 class VerbalizeFinalFst(GraphFst):
     """
     Finite state transducer that verbalizes an entire sentence, e.g.
     tokens { name: "its" } tokens { time { hours: "12" minutes: "30" } } tokens { name: "now" } -> its 12:30 now
+
+    Args:
+        cache_dir: path to a dir with .far grammar file. Set to None to avoid using cache.
+            The file name carries a fingerprint of the verbalizer sources and pynini version.
+        overwrite_cache: set to True to overwrite .far files
+        n_jobs: number of processes used to compile verbalizers
     """
 
-    def __init__(self):
+    def __init__(self, cache_dir: str = None, overwrite_cache: bool = False, n_jobs: int = 1):
         super().__init__(name="verbalize_final", kind="verbalize")
-        verbalize = VerbalizeFst().fst
-        word = WordFst().fst
-        types = verbalize | word
-        graph = (
-            pynutil.delete("tokens")
-            + delete_space
-            + pynutil.delete("{")
-            + delete_space
-            + types
-            + delete_space
-            + pynutil.delete("}")
-        )
-        graph = delete_space + pynini.closure(graph + delete_extra_space) + graph + delete_space
-        self.fst = graph
+
+        far_file = None
+        if cache_dir and cache_dir != "None":
+            os.makedirs(cache_dir, exist_ok=True)
+            sources = [get_abs_path(x) for x in ["verbalizers", "graph_utils.py", "utils.py"]]
+            fingerprint = get_fingerprint(sources)
+            far_file = os.path.join(cache_dir, f"vi_itn_verbalizer_{fingerprint[:16]}.far")
+
+        if not overwrite_cache and far_file and os.path.exists(far_file):
+            self.fst = pynini.Far(far_file, mode="r")["verbalize"]
+            logger.info(f"VerbalizeFinalFst.fst restored from {far_file}.")
+        else:
+            verbalize = VerbalizeFst(cache_dir=cache_dir, overwrite_cache=overwrite_cache, n_jobs=n_jobs).fst
+            word = WordFst.cached(cache_dir=cache_dir, overwrite_cache=overwrite_cache).fst
+            types = verbalize | word
+            graph = (
+                pynutil.delete("tokens")
+                + delete_space
+                + pynutil.delete("{")
+                + delete_space
+                + types
+                + delete_space
+                + pynutil.delete("}")
+            )
+            graph = delete_space + pynini.closure(graph + delete_extra_space) + graph + delete_space
+            self.fst = graph.optimize()
+
+            if far_file:
+                generator_main(far_file, {"verbalize": self.fst})
+                remove_stale_fars(far_file)
+
+        # every request composes tagged text with this graph, keep it sorted for composition
+        self.fst.arcsort(sort_type="ilabel")
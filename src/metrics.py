@@ -0,0 +1,78 @@
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+# for counts of texts, e.g. batch sizes
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class Metrics:
+    """Process-local counters, gauges and histograms rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.setdefault(name, {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0, "count": 0})
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def drain(self) -> dict:
+        """Returns counters and histograms recorded since the last drain and resets them, with the current gauges."""
+        with self._lock:
+            delta = {"counters": self._counters, "gauges": dict(self._gauges), "histograms": self._histograms}
+            self._counters = {}
+            self._histograms = {}
+        return delta
+
+    def merge(self, delta: dict):
+        """Adds what another process drained, its gauges replace the current values."""
+        with self._lock:
+            for name, value in delta["counters"].items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            self._gauges.update(delta["gauges"])
+            for name, other in delta["histograms"].items():
+                histogram = self._histograms.setdefault(
+                    name, {"buckets": other["buckets"], "counts": [0] * len(other["buckets"]), "sum": 0, "count": 0}
+                )
+                histogram["counts"] = [a + b for a, b in zip(histogram["counts"], other["counts"])]
+                histogram["sum"] += other["sum"]
+                histogram["count"] += other["count"]
+
+    def clear(self):
+        with self._lock:
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                lines += [f"# TYPE {name} counter", f"{name} {value}"]
+            for name, value in sorted(self._gauges.items()):
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+            for name, histogram in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {histogram["count"]}')
+                lines += [f"{name}_sum {histogram['sum']}", f"{name}_count {histogram['count']}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
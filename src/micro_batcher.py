@@ -0,0 +1,84 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from src.metrics import SIZE_BUCKETS, metrics
+from src.result_cache import ResultCache
+from src.worker_pool import WorkerPool
+
+
+class MicroBatcher:
+    """
+    Coalesces texts submitted concurrently into batches of at most `max_size` texts, waiting at most `max_delay`
+    seconds after the first text of a batch. A batch is deduplicated, served from `cache` where possible and the
+    rest is spread over the workers of `pool`, results are handed back to each caller.
+    Achieved batch sizes are exported as the viet_itn_microbatch_size histogram.
+    """
+
+    def __init__(self, pool: WorkerPool, max_size: int = 32, max_delay: float = 0.005, cache: ResultCache = None):
+        self.pool = pool
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.cache = cache
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # running batches, referenced so they are not garbage collected
+        self._tasks = set()
+
+    async def submit(self, text: str) -> str:
+        """Returns written form of `text`, raises what normalizing it raised, e.g. PoolFull."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        metrics.observe("viet_itn_microbatch_size", len(batch), buckets=SIZE_BUCKETS)
+        keys = [" ".join(text.split()) for text, _ in batch]
+        unique = list(dict.fromkeys(keys))
+        metrics.observe("viet_itn_microbatch_unique", len(unique), buckets=SIZE_BUCKETS)
+
+        outputs = {}
+        generation = self.cache.generation if self.cache is not None else None
+        if self.cache is not None:
+            for key in unique:
+                value = self.cache.get(key)
+                if value is not None:
+                    outputs[key] = value
+        misses = [key for key in unique if key not in outputs]
+
+        slice_size = max(1, -(-len(misses) // self.pool.workers))
+        try:
+            slices = await self.pool.map(
+                "inverse_normalize_batch", [(misses[i : i + slice_size],) for i in range(0, len(misses), slice_size)]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, output in zip(misses, (output for part in slices for output in part)):
+            outputs[key] = output
+            if self.cache is not None and not isinstance(output, Exception):
+                self.cache.put(key, output, generation)
+
+        for (_, future), key in zip(batch, keys):
+            if future.done():
+                continue
+            if isinstance(outputs[key], Exception):
+                future.set_exception(outputs[key])
+            else:
+                future.set_result(outputs[key])
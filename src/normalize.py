@@ -1,27 +1,155 @@
+import itertools
+import multiprocessing
 import os
-# import pynini
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Union
+
 import vinorm
-# from pynini.lib.rewrite import top_rewrite
+from joblib import Parallel, delayed
 from src.inverse_text_normalization import InverseNormalizer
+from src.result_cache import ResultCache
+
+def _compile_grammars(kwargs):
+    # builds the grammars and writes their FARs to the cache directory
+    InverseNormalizer(**kwargs)
+
 
 class InverseTextNormalizer:
-    def __init__(self):
+    def __init__(
+        self,
+        bundle_dir: str = None,
+        cache_size: int = 0,
+        cache_bytes: int = 0,
+        cache_ttl: float = None,
+        localize_spans: bool = False,
+        max_chunk_words: int = 0,
+        native_tokens: bool = True,
+        order_metrics: bool = True,
+        engine: str = "pipeline",
+        token_cache_size: int = 0
+    ):
         dir_path = os.path.dirname(os.path.realpath(__file__))
-        self.invert_text_normalizer = InverseNormalizer(
+        self.cache_dir = dir_path + "/cache"
+        self.bundle_dir = bundle_dir
+        self.localize_spans = localize_spans
+        self.native_tokens = native_tokens
+        self.order_metrics = order_metrics
+        # "pipeline" tags, parses and verbalizes tokens,
+        # "composed" rewrites in a single pass with the tagger precomposed with the verbalizer
+        if engine not in ("pipeline", "composed"):
+            raise ValueError(f"Unknown engine {engine}, expected 'pipeline' or 'composed'")
+        self.engine = engine
+        self.token_cache_size = token_cache_size
+        # texts are normalized in chunks of at most max_chunk_words words, disabled if 0
+        self.max_chunk_words = max_chunk_words
+        self.invert_text_normalizer = self._load()
+        # results keyed on whitespace-normalized input, disabled unless cache_size > 0
+        self.result_cache = ResultCache(cache_size, cache_bytes, cache_ttl) if cache_size > 0 else None
+
+    def _load(self) -> InverseNormalizer:
+        return InverseNormalizer(**self._grammar_args())
+
+    def _grammar_args(self) -> dict:
+        return dict(
             lang='vi',
-            cache_dir=dir_path + "/cache",
-            overwrite_cache=True
+            cache_dir=self.cache_dir,
+            overwrite_cache=False,
+            bundle_dir=self.bundle_dir,
+            localize_spans=self.localize_spans,
+            native_tokens=self.native_tokens,
+            order_metrics=self.order_metrics,
+            composed=self.engine == "composed",
+            token_cache_size=self.token_cache_size
         )
-        # reader_classifier = pynini.Far(os.path.join(dir_path, "far/classify/tokenize_and_classify.far"))
-        # reader_verbalizer = pynini.Far(os.path.join(dir_path, "far/verbalize/verbalize.far"))
-        # self.classifier = reader_classifier.get_fst()
-        # self.verbalizer = reader_verbalizer.get_fst()
+
+    def grammar_version(self) -> str:
+        """Fingerprint of the grammar a reload would load: the bundle manifest or the grammar sources."""
+        from src.inverse_text_normalization.vi.bundle import MANIFEST_FILE, get_grammar_hash
+
+        if self.bundle_dir:
+            manifest_file = os.path.join(self.bundle_dir, MANIFEST_FILE)
+            return str(os.stat(manifest_file).st_mtime_ns) if os.path.exists(manifest_file) else ""
+        return get_grammar_hash()
+
+    def reload(self):
+        """
+        Compiles (or restores from cache) a new tagger/verbalizer pair and swaps it in.
+        pynini holds the GIL while compiling, so grammars are compiled into the cache by a child process
+        and only the finished FARs are loaded here. Calls already running keep the normalizer they started with.
+        Returns compile and swap time in seconds.
+        """
+        start = time.perf_counter()
+        if not self.bundle_dir:
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("fork")) as executor:
+                executor.submit(_compile_grammars, self._grammar_args()).result()
+        invert_text_normalizer = self._load()
+        compiled = time.perf_counter()
+        self.invert_text_normalizer = invert_text_normalizer
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        return compiled - start, time.perf_counter() - compiled
 
     def normalize(self, text: str, verbose=False) -> str:
         return vinorm.TTSnorm(text)
     
     def inverse_normalize(self, text: str, verbose=False) -> str:
-        return self.invert_text_normalizer.inverse_normalize(text, verbose=verbose)
+        if verbose:
+            return self.invert_text_normalizer.inverse_normalize(text, verbose=verbose)
+        if self.result_cache is None:
+            return self._inverse_normalize(text)
+        return self.result_cache.get_or_compute(" ".join(text.split()), self._inverse_normalize)
+
+    def inverse_normalize_batch(self, texts: List[str], n_jobs: int = 1) -> List[Union[str, Exception]]:
+        """
+        Inverse normalizes a batch, inputs differing only in whitespace are normalized once.
+        With n_jobs > 1 the unique inputs are spread over that many worker processes.
+        Returns outputs in input order, with the raised exception in place of each input that failed.
+        """
+        keys = [" ".join(text.split()) for text in texts]
+        unique = list(dict.fromkeys(keys))
+        if n_jobs > 1 and len(unique) > 1:
+            batch_size = -(-len(unique) // n_jobs)
+            batches = Parallel(n_jobs=n_jobs)(
+                delayed(self._inverse_normalize_items)(unique[i : i + batch_size])
+                for i in range(0, len(unique), batch_size)
+            )
+            results = list(itertools.chain.from_iterable(batches))
+        else:
+            results = self._inverse_normalize_items(unique)
+        outputs = dict(zip(unique, results))
+        return [outputs[key] for key in keys]
+
+    def inverse_normalize_words(self, words: List[Tuple[str, float, float]]) -> List[Tuple[str, float, float]]:
+        """
+        Inverse normalizes ASR words with start and end times in a single tagger pass.
+        Each written token gets the start of the first and the end of the last spoken word it was made from,
+        e.g. [("ba", 1.0, 1.2), ("mươi", 1.2, 1.5)] -> [("30", 1.0, 1.5)]
+        """
+        # index of the ASR word each white space delimited piece of the text belongs to
+        pieces = [i for i, (word, _, _) in enumerate(words) for _ in word.split()]
+        text = " ".join(word for word, _, _ in words)
+        spans = self.invert_text_normalizer.inverse_normalize_spans(text, max_words=self.max_chunk_words or 200)
+        output = []
+        for written, start, end in spans:
+            # a token with an empty span takes the times of the word it stands before
+            first, last = (pieces[min(i, len(pieces) - 1)] for i in (start, max(start, end - 1)))
+            output.append((written, words[first][1], words[last][2]))
+        return output
+
+    def _inverse_normalize_items(self, texts: List[str]) -> List[Union[str, Exception]]:
+        results = []
+        for text in texts:
+            try:
+                results.append(self.inverse_normalize(text))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _inverse_normalize(self, text: str) -> str:
+        if self.max_chunk_words:
+            return self.invert_text_normalizer.inverse_normalize_chunked(text, max_words=self.max_chunk_words)
+        return self.invert_text_normalizer.inverse_normalize(text, verbose=False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from src.metrics import metrics
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache bounded by number of entries and by the UTF-8 size of keys and values.
+    Entries older than `ttl` seconds are treated as misses. Concurrent misses on the same key are
+    computed once (single-flight), the other callers wait for that result.
+    Hits, misses, coalesced waits, expirations and evictions are exported as `<name>_*_total` counters.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int = 0, ttl: Optional[float] = None, name: str = "viet_itn_result_cache"):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._bytes = 0
+        self._generation = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "coalesced": 0}
+
+    def _count(self, stat: str):
+        self._stats[stat] += 1
+        metrics.inc(f"{self.name}_{stat}_total")
+
+    def _remove(self, key: str):
+        value, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl and time.monotonic() - entry[1] > self.ttl:
+            self._remove(key)
+            self._count("expirations")
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, value: str):
+        size = len(key.encode("utf-8")) + len(value.encode("utf-8"))
+        if self.max_bytes and size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, time.monotonic(), size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self._count("evictions")
+        metrics.set(f"{self.name}_entries", len(self._entries))
+        metrics.set(f"{self.name}_bytes", self._bytes)
+
+    def get_or_compute(self, key: str, compute: Callable[[str], str]) -> str:
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self._count("hits")
+                return entry[0]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self._count("misses")
+                flight = self._flights[key] = _Flight()
+                generation = self._generation
+            else:
+                self._count("coalesced")
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute(key)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None and generation == self._generation:
+                    self._store(key, flight.value)
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    @property
+    def generation(self) -> int:
+        """Incremented by `clear`, pass it to `put` to drop results computed before a clear."""
+        return self._generation
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached value or None, counted as a hit or a miss."""
+        with self._lock:
+            entry = self._lookup(key)
+            self._count("misses" if entry is None else "hits")
+            return None if entry is None else entry[0]
+
+    def put(self, key: str, value: str, generation: Optional[int] = None):
+        """Stores a value computed elsewhere, unless the cache was cleared since `generation`."""
+        with self._lock:
+            if generation is None or generation == self._generation:
+                self._store(key, value)
+
+    def clear(self):
+        """Drops all entries; results still being computed are not stored."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+            metrics.set(f"{self.name}_entries", 0)
+            metrics.set(f"{self.name}_bytes", 0)
+
+    def __getstate__(self):
+        # worker processes start with an empty cache of the same size
+        return {"max_entries": self.max_entries, "max_bytes": self.max_bytes, "ttl": self.ttl, "name": self.name}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes)
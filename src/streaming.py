@@ -0,0 +1,169 @@
+import asyncio
+import collections
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+import pynini
+
+from src.inverse_text_normalization.vi.triggers import TriggerIndex
+from src.metrics import metrics
+
+
+def _common_prefix(a: List[str], b: List[str]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class StreamSession:
+    """
+    Inverse normalizes a live transcript sent as partial ASR hypotheses, e.g. over a WebSocket.
+
+    Each update carries the current hypothesis of the segment being recognized, `final` marks the last one of
+    a segment, later updates start the next segment. Words are stable once the segment is final or once two
+    consecutive hypotheses agree on them. The transcript is committed up to the last boundary between two stable
+    words that no semiotic token can span (see `TriggerIndex.is_boundary`), the committed part is normalized once
+    and never revisited. Only the tail after it is normalized again on the next update.
+    A number phrase split across hypotheses or segments, e.g. "một trăm" followed by "hai mươi lăm",
+    stays in the tail until a word that can not continue it arrives.
+
+    Args:
+        triggers: returns the TriggerIndex of the current grammars
+        normalize: coroutine returning written form of a text
+    """
+
+    def __init__(self, triggers: Callable[[], TriggerIndex], normalize: Callable[[str], Awaitable[str]]):
+        self.triggers = triggers
+        self.normalize = normalize
+        # words of final segments not committed yet
+        self.pending: List[str] = []
+        # hypothesis of the current segment and how many of its words are committed
+        self.previous: List[str] = []
+        self.offset = 0
+        self._tail = ("", "")
+
+    async def update(self, text: str, final: bool = False, flush: bool = False) -> Tuple[str, str]:
+        """
+        Args:
+            text: current hypothesis of the segment being recognized
+            final: whether the hypothesis is final, the next update starts a new segment
+            flush: commit everything, e.g. at the end of the stream
+
+        Returns written form of the text committed by this update, to append to what was committed before,
+        and written form of the uncommitted tail, which may still change
+        """
+        if not isinstance(text, str):
+            raise ValueError(f"text must be a string, got {type(text).__name__}")
+        current = text.split()
+        if current[: self.offset] != self.previous[: self.offset]:
+            # committed words were revised, they stay committed
+            metrics.inc("viet_itn_stream_revised_total")
+        segment = current[self.offset :]
+        words = self.pending + segment
+        if final or flush:
+            stable = len(words)
+        else:
+            stable = len(self.pending) + _common_prefix(self.previous[self.offset :], segment)
+        # a boundary between words i - 1 and i can be committed once both are stable
+        cut = len(words) if flush else 0
+        triggers = self.triggers()
+        for i in range(min(stable, len(words)) - 1 if not flush else 0, 0, -1):
+            if triggers.is_boundary(pynini.escape(words[i - 1]), pynini.escape(words[i])):
+                cut = i
+                break
+
+        # state changes only after both parts are normalized, so a failed update can be retried
+        committed = await self._normalize(" ".join(words[:cut])) if cut else ""
+        pending, offset, previous = words[cut:], self.offset + max(0, cut - len(self.pending)), current
+        if final or flush:
+            offset, previous = 0, []
+        else:
+            pending = pending[: max(0, len(self.pending) - cut)]
+        tail = " ".join(pending + previous[offset:])
+        if tail != self._tail[0]:
+            self._tail = (tail, await self._normalize(tail))
+        self.pending, self.offset, self.previous = pending, offset, previous
+        metrics.inc("viet_itn_stream_updates_total")
+        metrics.inc("viet_itn_stream_committed_words_total", cut)
+        return committed, self._tail[1]
+
+    async def _normalize(self, text: str) -> str:
+        triggers = self.triggers()
+        if not text or not (triggers.search(text) or triggers.punctuation_only(text)):
+            return TriggerIndex.passthrough(text)
+        return await self.normalize(text)
+
+
+async def read_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Optional[bytes]]:
+    """
+    Splits a byte stream into lines without buffering more than one line, yields None in place of a line
+    longer than `max_line_bytes`, which is skipped.
+    """
+    buffer = b""
+    skipping = False
+    async for chunk in chunks:
+        *lines, rest = (buffer + chunk).split(b"\n")
+        for line in lines:
+            yield None if skipping or len(line) > max_line_bytes else line.rstrip(b"\r")
+            skipping = False
+        buffer = b"" if skipping else rest
+        if len(buffer) > max_line_bytes:
+            buffer = b""
+            skipping = True
+    if skipping:
+        yield None
+    elif buffer:
+        yield buffer.rstrip(b"\r")
+
+
+async def normalize_lines(
+    items: AsyncIterator[Tuple[int, str]],
+    normalize: Callable[[str], Awaitable[str]],
+    window: int,
+    ordered: bool = True,
+) -> AsyncIterator[Tuple[int, object]]:
+    """
+    Normalizes (index, text) items with at most `window` texts in flight. The next item is read only when a text
+    completes, so a slow consumer or busy workers stop reading of the input.
+
+    Args:
+        items: indexed texts
+        normalize: coroutine returning written form of a text
+        window: maximum number of texts normalized at the same time
+        ordered: yield results in input order, otherwise in completion order
+
+    Returns iterator of (index, written form) pairs, with the raised exception in place of texts that failed
+    """
+
+    async def run(index: int, text: str):
+        try:
+            return index, await normalize(text)
+        except Exception as e:
+            return index, e
+
+    in_flight = collections.deque() if ordered else set()
+    try:
+        async for index, text in items:
+            task = asyncio.create_task(run(index, text))
+            if ordered:
+                in_flight.append(task)
+                while in_flight and (len(in_flight) >= window or in_flight[0].done()):
+                    yield await in_flight.popleft()
+            else:
+                in_flight.add(task)
+                if len(in_flight) >= window:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+        while in_flight:
+            if ordered:
+                yield await in_flight.popleft()
+            else:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+    finally:
+        for task in in_flight:
+            task.cancel()
@@ -0,0 +1,250 @@
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pynini
+
+from src.worker_pool import watch_parent
+
+SUBTITLE_EXTENSIONS = (".srt", ".vtt")
+# markup inside cue text, WebVTT tags (<i>, <c.yellow>, <00:01.000>) and SRT positioning ({\an8})
+MARKUP = re.compile(r"(<[^>]*>|\{[^}]*\})")
+# normalizer of the subtitle workers, inherited when the pool forks them
+_normalizer = None
+
+
+class _Line:
+    """A text line of a cue. `text` holds the spoken form until the cue is normalized."""
+
+    def __init__(self, cue: int, text: str, ending: str):
+        self.cue = cue
+        self.text = text
+        self.ending = ending
+        self.markup = MARKUP.search(text) is not None
+        # words were moved to its start from the previous line, they must not be moved on
+        self.pinned = False
+        self.dropped = False
+
+
+def read_blocks(lines: Iterable[str]) -> Iterator[List[str]]:
+    """Groups lines, read with their line endings, into blocks each ending with a blank line."""
+    block = []
+    for line in lines:
+        block.append(line)
+        if not line.strip():
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+class SubtitleNormalizer:
+    """
+    Inverse normalizes the cue text of SRT and WebVTT files, timings, cue identifiers, settings, headers and
+    NOTE/STYLE blocks are written back untouched, as are line endings and markup such as <i> or {\\an8}.
+
+    Files are read block by block. Text lines of `window` cues are normalized together with one
+    `inverse_normalize_batch` call, repeated lines are normalized once.
+    A number phrase split over two lines or cues, e.g. "một trăm" / "hai mươi người", would be normalized as two
+    numbers. Where no semiotic token can span the break (see `TriggerIndex.is_boundary`) lines are normalized on
+    their own. Otherwise the phrase is normalized across the break and, if that changes the result, its words are
+    moved to one side: the start of the next line joins the previous one, or the end of the previous line the next one,
+    whichever leaves both lines with text. If the phrase is all of both lines, lines of one cue are joined, lines of
+    two cues are left as they are since a cue without text would end the block. Lines with markup are
+    normalized between the tags and never joined.
+
+    Args:
+        normalizer: InverseTextNormalizer
+        window: cues normalized together
+    """
+
+    def __init__(self, normalizer, window: int = 256):
+        self.normalizer = normalizer
+        self.window = window
+        self.stats = {"cues": 0, "lines": 0, "joined": 0, "errors": 0}
+
+    def normalize_file(self, input_path: str, output_path: str) -> Dict:
+        """Writes `input_path` with normalized cue text to `output_path`. Returns statistics of the file."""
+        self.stats = {"cues": 0, "lines": 0, "joined": 0, "errors": 0}
+        start = time.perf_counter()
+        with open(input_path, encoding="utf-8", newline="") as f_in, open(output_path, "w", encoding="utf-8", newline="") as f_out:
+            # parsed blocks not written yet, the last cue waits for the next one as a phrase may continue into it
+            pending = []
+            cues = waiting = 0
+            for block in read_blocks(f_in):
+                pending.append(self._parse(block, cues))
+                if pending[-1][1] is not None:
+                    cues += 1
+                    waiting += 1
+                    if waiting > self.window:
+                        pending = self._flush(pending, f_out, final=False)
+                        waiting = 1
+            self._flush(pending, f_out, final=True)
+        self.stats["seconds"] = time.perf_counter() - start
+        return dict(self.stats)
+
+    @staticmethod
+    def _parse(block: List[str], cue: int) -> Tuple[List[str], Optional[List[_Line]], List[str]]:
+        # a cue is an optional identifier, the timing line and text lines, other blocks are kept as they are
+        timing = next((i for i, line in enumerate(block) if "-->" in line), None)
+        if timing is None:
+            return block, None, []
+        end = len(block)
+        while end > timing + 1 and not block[end - 1].strip():
+            end -= 1
+        lines = []
+        for line in block[timing + 1 : end]:
+            text = line.rstrip("\r\n")
+            lines.append(_Line(cue, text, line[len(text) :]))
+        return block[: timing + 1], lines, block[end:]
+
+    def _flush(self, pending: List, out, final: bool) -> List:
+        lines = [line for _, text, _ in pending if text is not None for line in text]
+        self._join_straddling(lines)
+        keep = len(pending)
+        if not final:
+            keep = max(i for i, (_, text, _) in enumerate(pending) if text is not None)
+        self._normalize_lines([line for _, text, _ in pending[:keep] if text is not None for line in text])
+        for header, text, trailer in pending[:keep]:
+            out.write("".join(header))
+            if text is not None:
+                self.stats["cues"] += 1
+                for line in text:
+                    if not line.dropped:
+                        out.write(line.text + line.ending)
+                        self.stats["lines"] += 1
+                out.write("".join(trailer))
+        return pending[keep:]
+
+    def _join_straddling(self, lines: List[_Line]):
+        triggers = self.normalizer.invert_text_normalizer.triggers
+        lines = [line for line in lines if line.text.strip() and not line.dropped]
+        candidates = []
+        for a, b in zip(lines, lines[1:]):
+            if a.markup or b.markup:
+                continue
+            if triggers.is_boundary(pynini.escape(a.text.split()[-1]), pynini.escape(b.text.split()[0])):
+                continue
+            tail, tail_trigger = triggers.segments(a.text)[-1]
+            head, head_trigger = triggers.segments(b.text)[0]
+            if tail_trigger or head_trigger:
+                candidates.append((a, b, tail, head))
+        if not candidates:
+            return
+        texts = list(dict.fromkeys(text for _, _, tail, head in candidates for text in (tail, head, f"{tail} {head}")))
+        written = dict(zip(texts, self.normalizer.inverse_normalize_batch(texts)))
+        for a, b, tail, head in candidates:
+            joined, separate = written[f"{tail} {head}"], (written[tail], written[head])
+            if a.dropped or b.dropped or any(isinstance(result, Exception) for result in (joined, *separate)):
+                continue
+            if joined == " ".join(separate):
+                continue
+            a_words, b_words = a.text.split(), b.text.split()
+            n_tail, n_head = len(tail.split()), len(head.split())
+            if b_words[:n_head] != head.split() or a_words[-n_tail:] != tail.split():
+                # changed by a move at a neighbouring break
+                continue
+            if n_head < len(b_words):
+                a.text, b.text = " ".join(a_words + b_words[:n_head]), " ".join(b_words[n_head:])
+            elif n_tail < len(a_words) and not a.pinned:
+                a.text, b.text = " ".join(a_words[:-n_tail]), " ".join(a_words[-n_tail:] + b_words)
+                b.pinned = True
+            elif a.cue == b.cue:
+                a.text = " ".join(a_words + b_words)
+                b.dropped = True
+            else:
+                continue
+            self.stats["joined"] += 1
+
+    def _normalize_lines(self, lines: List[_Line]):
+        # each line is split into text and markup, text parts keep the white space around them
+        parts = [MARKUP.split(line.text) if line.markup else [line.text] for line in lines]
+        texts = list(dict.fromkeys(part.strip() for line in parts for part in line[::2] if part.strip()))
+        written = dict(zip(texts, self.normalizer.inverse_normalize_batch(texts)))
+        for line, line_parts in zip(lines, parts):
+            for i in range(0, len(line_parts), 2):
+                text = line_parts[i].strip()
+                if not text:
+                    continue
+                result = written[text]
+                if isinstance(result, Exception):
+                    self.stats["errors"] += 1
+                    continue
+                part = line_parts[i]
+                line_parts[i] = part[: len(part) - len(part.lstrip())] + result + part[len(part.rstrip()) :]
+            line.text = "".join(line_parts)
+
+
+def find_subtitles(inputs: List[str], exclude: Optional[str] = None) -> List[str]:
+    """
+    Returns the given files and the .srt and .vtt files under the given directories. Subtitles written by an earlier
+    run, named <name>.itn.srt or in the `exclude` directory below them, are skipped.
+    """
+    exclude = os.path.realpath(exclude) if exclude else None
+    files = []
+    for path in inputs:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs[:] = [name for name in dirs if os.path.realpath(os.path.join(root, name)) != exclude]
+            files.extend(
+                os.path.join(root, name)
+                for name in sorted(names)
+                if name.lower().endswith(SUBTITLE_EXTENSIONS) and not os.path.splitext(name)[0].endswith(".itn")
+            )
+    return files
+
+
+def _run_file(input_path: str, output_path: str, window: int) -> Dict:
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp = f"{output_path}.{os.getpid()}.tmp"
+    stats = SubtitleNormalizer(_normalizer, window=window).normalize_file(input_path, tmp)
+    os.replace(tmp, output_path)
+    return stats
+
+
+def normalize_subtitle_files(
+    normalizer, files: List[Tuple[str, str]], workers: int = 1, window: int = 256
+) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+    """
+    Normalizes (input, output) subtitle file pairs, each file on one of `workers` forked processes sharing the loaded
+    grammars. An output is written to a temporary file and renamed, so it is either complete or missing.
+
+    Yields (input, statistics, error) as files finish, with the error message if the file failed
+    """
+    global _normalizer
+    _normalizer = normalizer
+    if workers <= 1:
+        for input_path, output_path in files:
+            try:
+                result = input_path, _run_file(input_path, output_path, window), None
+            except Exception as e:
+                result = input_path, None, f"{type(e).__name__}: {e}"
+            yield result
+        return
+    executor = ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("fork"), initializer=watch_parent, initargs=(os.getpid(),)
+    )
+    try:
+        todo = iter(files)
+        running = {}
+        while True:
+            for input_path, output_path in todo:
+                running[executor.submit(_run_file, input_path, output_path, window)] = input_path
+                if len(running) >= 2 * workers:
+                    break
+            if not running:
+                break
+            for future in wait(running, return_when=FIRST_COMPLETED).done:
+                input_path = running.pop(future)
+                try:
+                    result = input_path, future.result(), None
+                except Exception as e:
+                    result = input_path, None, f"{type(e).__name__}: {e}"
+                yield result
+    finally:
+        executor.shutdown(cancel_futures=True)
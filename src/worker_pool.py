@@ -0,0 +1,140 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, List, Sequence
+
+from src.metrics import metrics
+
+# normalizer the workers call, process workers inherit it when the pool forks them
+_normalizer = None
+# set in process workers, their metrics are sent back to the parent with each result
+_forked = False
+
+
+class PoolFull(Exception):
+    """Raised when more calls would wait for a worker than the queue holds."""
+
+
+def watch_parent(parent: int):
+    """Pool initializer exiting the worker once `parent` is gone, a worker blocked on its call queue would outlive it."""
+
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(1)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def _init_process(parent: int):
+    global _forked
+    watch_parent(parent)
+    _forked = True
+    # counts inherited from the parent would be sent back twice
+    metrics.clear()
+    # results are cached once, in the parent
+    _normalizer.result_cache = None
+
+
+def _call(method: str, args: tuple, submitted: float):
+    waited = time.time() - submitted
+    try:
+        result, error = getattr(_normalizer, method)(*args), None
+    except Exception as e:
+        result, error = None, e
+    return waited, result, error, metrics.drain() if _forked else None
+
+
+class WorkerPool:
+    """
+    Runs methods of a normalizer on worker threads or forked worker processes, so CPU-bound normalization
+    does not block the event loop. At most `max_queue` calls wait for a free worker, further calls raise
+    PoolFull instead of queueing without bound.
+    Process workers share the grammars the parent loaded, call `restart` to fork new ones after a reload.
+    Metrics they record are merged into the parent's with each result. They do not use the result cache of the
+    normalizer, callers look results up in the parent's cache instead.
+    Queue depth, busy workers, rejected calls and time spent waiting are exported as viet_itn_pool_* metrics.
+    """
+
+    def __init__(self, normalizer, workers: int = 1, max_queue: int = 64, kind: str = "thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown pool kind {kind}, expected 'thread' or 'process'")
+        self.normalizer = normalizer
+        self.workers = workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._lock = threading.Lock()
+        # calls submitted and not finished yet, running or waiting
+        self._pending = 0
+        self._executor = self._create()
+
+    def _create(self):
+        global _normalizer
+        _normalizer = self.normalizer
+        if self.kind == "thread":
+            return ThreadPoolExecutor(self.workers, thread_name_prefix="viet-itn")
+        executor = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_process,
+            initargs=(os.getpid(),),
+        )
+        # fork the workers now rather than on the first request
+        executor.submit(int).result()
+        return executor
+
+    def _update(self, delta: int):
+        with self._lock:
+            self._pending += delta
+            metrics.set("viet_itn_pool_queue_depth", max(0, self._pending - self.workers))
+            metrics.set("viet_itn_pool_busy_workers", min(self._pending, self.workers))
+
+    def _reserve(self, n: int):
+        with self._lock:
+            if self._pending + n > self.workers + self.max_queue:
+                metrics.inc("viet_itn_pool_rejected_total")
+                raise PoolFull(f"{self._pending} calls pending, the queue holds {self.max_queue}")
+        self._update(n)
+
+    async def run(self, method: str, *args) -> Any:
+        """Returns `normalizer.<method>(*args)` computed by a worker."""
+        return (await self.map(method, [args]))[0]
+
+    async def map(self, method: str, args: Sequence[tuple]) -> List[Any]:
+        """Calls `normalizer.<method>` once per argument tuple, spread over the workers. Queued all or nothing."""
+        if not args:
+            return []
+        self._reserve(len(args))
+        loop = asyncio.get_running_loop()
+        submitted = time.time()
+        futures = []
+        for call_args in args:
+            future = loop.run_in_executor(self._executor, _call, method, call_args, submitted)
+            future.add_done_callback(lambda _: self._update(-1))
+            futures.append(future)
+        try:
+            results = await asyncio.gather(*futures)
+        except BrokenProcessPool:
+            self.restart()
+            raise
+        for waited, _, _, delta in results:
+            if delta is not None:
+                metrics.merge(delta)
+            metrics.observe("viet_itn_pool_wait_seconds", waited)
+        for _, _, error, _ in results:
+            if error is not None:
+                raise error
+        return [result for _, result, _, _ in results]
+
+    def restart(self):
+        """Replaces the workers, calls already running finish on the old ones."""
+        executor = self._executor
+        self._executor = self._create()
+        executor.shutdown(wait=False)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,20 @@
+import pytest
+
+from src.normalize import InverseTextNormalizer
+
+
+@pytest.fixture(scope="session")
+def normalizer():
+    return InverseTextNormalizer()
+
+
+@pytest.fixture(scope="session")
+def api():
+    # the server is configured from the environment when src.api is imported
+    with pytest.MonkeyPatch.context() as mp:
+        mp.delenv("VIET_ITN_POOL", raising=False)
+        mp.setenv("VIET_ITN_CACHE_SIZE", "16")
+        mp.setenv("VIET_ITN_TOKEN_CACHE_SIZE", "16")
+        from src import api
+
+        yield api
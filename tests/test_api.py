@@ -0,0 +1,152 @@
+import asyncio
+import json
+import re
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import src.normalize
+
+
+def compile_holding_gil(kwargs):
+    # stands in for pynini compiling, a backtracking regex does not release the GIL for about two seconds
+    re.match(r"(a+)+b", "a" * 25)
+
+
+def test_watcher_does_not_retry_failed_reload(api, monkeypatch):
+    versions = iter(["v1", "v1", "v1", "v2", "v2", "v2"])
+    reloads = []
+
+    def version():
+        return next(versions, "v2")
+
+    def reload():
+        reloads.append(None)
+        raise RuntimeError("broken grammar")
+
+    monkeypatch.setattr(api.inverse_normalizer, "grammar_version", version)
+    monkeypatch.setattr(api.inverse_normalizer, "reload", reload)
+    monkeypatch.setattr(api, "grammar_version", "v0")
+
+    async def watch():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(api.watch_grammars(0.001), 0.2)
+
+    asyncio.run(watch())
+    # one attempt for v1 and one once the sources changed to v2
+    assert len(reloads) == 2
+    assert api.grammar_version == "v0"
+
+
+def test_watcher_survives_version_errors(api, monkeypatch):
+    calls = []
+
+    def version():
+        calls.append(None)
+        raise OSError("manifest unreadable")
+
+    monkeypatch.setattr(api.inverse_normalizer, "grammar_version", version)
+
+    async def watch():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(api.watch_grammars(0.001), 0.1)
+
+    asyncio.run(watch())
+    assert len(calls) > 1
+
+
+def test_words_endpoint_rejects_untaggable_and_long_requests(api, monkeypatch):
+    async def run(method, words):
+        raise ValueError("No tagging found")
+
+    words = [{"word": "ba", "start": 0.0, "end": 0.2}, {"word": "mươi", "start": 0.2, "end": 0.5}]
+    # without the lifespan, which shuts the pool down
+    client = TestClient(api.app)
+    monkeypatch.setattr(api, "max_batch_size", 1)
+    assert client.post("/normalize/words", json={"words": words}).status_code == 413
+    monkeypatch.setattr(api, "max_batch_size", 2)
+    monkeypatch.setattr(api.pool, "run", run)
+    response = client.post("/normalize/words", json={"words": words})
+    assert response.status_code == 422
+    assert "No tagging found" in response.json()["detail"]
+
+
+def test_health_answers_during_reload(api, monkeypatch):
+    monkeypatch.setattr(src.normalize, "_compile_grammars", compile_holding_gil)
+
+    async def reload_and_poll():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            reload = asyncio.create_task(client.post("/admin/reload"))
+            await asyncio.sleep(0.2)
+            latencies = []
+            while not reload.done():
+                start = time.perf_counter()
+                assert (await client.get("/health")).status_code == 200
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.05)
+            return (await reload).status_code, latencies
+
+    status, latencies = asyncio.run(reload_and_poll())
+    assert status == 200
+    assert len(latencies) > 5
+    assert max(latencies) < 0.5
+
+
+def test_websocket_survives_invalid_text(api):
+    # without the lifespan, which shuts the pool down
+    client = TestClient(api.app)
+    with client.websocket_connect("/normalize/ws") as websocket:
+        for text in [5, None]:
+            websocket.send_json({"text": text})
+            assert "text must be a string" in websocket.receive_json()["error"]
+        websocket.send_json({"text": "xin chào", "flush": True})
+        assert websocket.receive_json() == {"committed": "xin chào", "tail": ""}
+
+
+@pytest.mark.parametrize("order, indexes", [("input", [0, 1, 2, 3]), ("completion", [1, 2, 3, 0])])
+def test_stream_endpoint_orders_results(api, monkeypatch, order, indexes):
+    delays = {"một": 0.3, "hai": 0.05, "bốn": 0.1, "mười": 0.15}
+
+    async def normalize_text(text):
+        await asyncio.sleep(delays[text])
+        return text.upper()
+
+    monkeypatch.setattr(api, "normalize_text", normalize_text)
+    monkeypatch.setattr(api, "stream_window", 4)
+    # without the lifespan, which shuts the pool down
+    client = TestClient(api.app)
+    response = client.post(
+        f"/normalize/stream?order={order}",
+        content="một\nhai\nbốn\r\nmười\n".encode(),
+        headers={"Content-Type": "text/plain"},
+    )
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [record["index"] for record in records] == indexes
+    assert {record["index"]: record["normalized_text"] for record in records} == {0: "MỘT", 1: "HAI", 2: "BỐN", 3: "MƯỜI"}
+    assert client.post("/normalize/stream?order=random", content=b"").status_code == 422
+
+
+def test_stream_endpoint_reports_oversized_and_malformed_lines(api, monkeypatch):
+    async def normalize_text(text):
+        return text.upper()
+
+    monkeypatch.setattr(api, "normalize_text", normalize_text)
+    monkeypatch.setattr(api, "max_batch_bytes", 32)
+    lines = ['"một"', "", '{"text": "hai"}', '{"value": "ba"}', "5", "{", '"' + "bốn " * 10 + '"', '{"text": "năm"}']
+    # without the lifespan, which shuts the pool down
+    client = TestClient(api.app)
+    response = client.post(
+        "/normalize/stream", content="\n".join(lines).encode(), headers={"Content-Type": "application/x-ndjson"}
+    )
+    records = [json.loads(line) for line in response.text.splitlines()]
+    # blank lines are skipped, every other line gets a record in input order
+    assert [record["index"] for record in records] == list(range(7))
+    assert [record.get("normalized_text") for record in records] == ["MỘT", "HAI", None, None, None, None, "NĂM"]
+    errors = [record["error"] for record in records[2:6]]
+    assert errors[0].startswith("KeyError")
+    assert errors[1].startswith("ValueError: Expected a string")
+    assert errors[2].startswith("JSONDecodeError")
+    assert errors[3] == "ValueError: Line is longer than 32 bytes"
@@ -0,0 +1,31 @@
+from src.columns import ColumnNormalizer
+
+
+def test_csv_keeps_extra_fields_and_failed_values(normalizer, monkeypatch, tmp_path):
+    normalize_batch = normalizer.inverse_normalize_batch
+    calls = []
+
+    def inverse_normalize_batch(texts, n_jobs=1):
+        calls.append(list(texts))
+        outputs = normalize_batch(texts, n_jobs=n_jobs)
+        return [ValueError("no tagging") if text == "hỏng" else output for text, output in zip(texts, outputs)]
+
+    monkeypatch.setattr(normalizer, "inverse_normalize_batch", inverse_normalize_batch)
+    input_path, output_path = tmp_path / "in.csv", tmp_path / "out.csv"
+    input_path.write_text(
+        'id,text\n1,"một  trăm"\n2,"  hỏng "\n3,hai mươi,extra1,extra2\n4\n5,"  hỏng "\n6,một  trăm\n', encoding="utf-8"
+    )
+    stats = ColumnNormalizer(normalizer, ["text"], chunk_rows=2).normalize_file(str(input_path), str(output_path))
+    assert output_path.read_text(encoding="utf-8").splitlines() == [
+        "id,text,text_itn",
+        "1,một  trăm,100",
+        "2,  hỏng ,  hỏng ",
+        "3,hai mươi,20,extra1,extra2",
+        "4,,",
+        "5,  hỏng ,  hỏng ",
+        "6,một  trăm,100",
+    ]
+    # the failed value is not tried again in later chunks
+    assert calls == [["một trăm", "hỏng"], ["hai mươi"]]
+    assert stats["errors"] == 1
+    assert stats["values"] == 5 and stats["normalized"] == 3
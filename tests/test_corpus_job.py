@@ -0,0 +1,72 @@
+import os
+import socket
+
+import pytest
+
+from src.corpus_job import CorpusJob
+
+LINES = [
+    "tổng chi phí là một triệu hai trăm hai mươi hai nghìn đồng",
+    "xin chào các bạn",
+    "",
+    "đuôi số điện thoại của tôi là năm tám năm năm",
+    "giá của nó là một triệu rưỡi",
+    "hẹn gặp lúc mười giờ chín phút bốn mươi lăm giây",
+] * 5
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / "corpus.txt"
+    path.write_text("\n".join(LINES) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def run(normalizer, corpus, output, work_dir, **kwargs):
+    return CorpusJob(normalizer, corpus, output, work_dir, shard_bytes=256, workers=2, **kwargs).run(poll_interval=0.1)
+
+
+def test_output_matches_line_by_line(normalizer, corpus, tmp_path):
+    stats = run(normalizer, corpus, str(tmp_path / "out.txt"), str(tmp_path / "work"))
+    assert stats["shards"] > 3 and stats["lines"] == len(LINES) and stats["errors"] == 0
+    expected = [normalizer.inverse_normalize(line) if line.strip() else line for line in LINES]
+    assert (tmp_path / "out.txt").read_text(encoding="utf-8").split("\n")[:-1] == expected
+
+
+def test_resume_redoes_only_unfinished_shards(normalizer, corpus, tmp_path):
+    work_dir = str(tmp_path / "work")
+    run(normalizer, corpus, str(tmp_path / "first.txt"), work_dir)
+    shard_dir = os.path.join(work_dir, "shards")
+    # a run that died: one shard never finished and another is still locked by a process that is gone
+    os.remove(os.path.join(shard_dir, "000001.json"))
+    os.remove(os.path.join(shard_dir, "000002.json"))
+    with open(os.path.join(shard_dir, "000002.lock"), "w") as f:
+        f.write(f"{socket.gethostname()} 999999999")
+    os.remove(os.path.join(work_dir, "merged"))
+    stats = run(normalizer, corpus, str(tmp_path / "second.txt"), work_dir)
+    assert stats["processed_shards"] == 2
+    assert (tmp_path / "second.txt").read_bytes() == (tmp_path / "first.txt").read_bytes()
+
+
+def test_finished_job_merges_again_for_another_or_missing_output(normalizer, corpus, tmp_path):
+    work_dir = str(tmp_path / "work")
+    run(normalizer, corpus, str(tmp_path / "out.txt"), work_dir)
+    expected = (tmp_path / "out.txt").read_bytes()
+    stats = run(normalizer, corpus, str(tmp_path / "other.txt"), work_dir)
+    assert stats["processed_shards"] == 0
+    assert (tmp_path / "other.txt").read_bytes() == expected
+    os.remove(tmp_path / "out.txt")
+    run(normalizer, corpus, str(tmp_path / "out.txt"), work_dir)
+    assert (tmp_path / "out.txt").read_bytes() == expected
+
+
+def test_work_dir_of_another_job_is_rejected(normalizer, corpus, tmp_path):
+    work_dir = str(tmp_path / "work")
+    run(normalizer, corpus, str(tmp_path / "out.txt"), work_dir)
+    with pytest.raises(ValueError, match="jsonl"):
+        run(normalizer, corpus, str(tmp_path / "out.txt"), work_dir, jsonl=True)
+
+
+def test_workers_must_be_positive(normalizer, corpus, tmp_path):
+    with pytest.raises(ValueError, match="workers"):
+        CorpusJob(normalizer, corpus, str(tmp_path / "out.txt"), str(tmp_path / "work"), workers=0)
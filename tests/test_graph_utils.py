@@ -0,0 +1,40 @@
+import pytest
+
+from src.inverse_text_normalization.vi.graph_utils import build_graphs, remove_stale_fars
+
+
+class Grammar:
+    def __init__(self, value):
+        self.value = value
+
+    @classmethod
+    def cached(cls, cache_dir, overwrite_cache=False, **kwargs):
+        return cls(sum(graph.value for graph in kwargs.values()) + 1)
+
+
+SPECS = {"cardinal": (Grammar, (), {}), "decimal": (Grammar, ("cardinal",), {}), "money": (Grammar, ("cardinal", "decimal"), {})}
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2, -1])
+def test_build_graphs_in_dependency_order(n_jobs):
+    graphs = build_graphs(SPECS, n_jobs=n_jobs)
+    assert {name: graph.value for name, graph in graphs.items()} == {"cardinal": 1, "decimal": 2, "money": 4}
+
+
+def test_build_graphs_rejects_zero_jobs():
+    with pytest.raises(ValueError):
+        build_graphs(SPECS, n_jobs=0)
+
+
+def test_remove_stale_fars_keeps_other_grammars(tmp_path):
+    names = [
+        "vi_itn_lower_cased_0123456789abcdef.far",
+        "vi_itn_lower_cased_fedcba9876543210.far",
+        "vi_itn_cased_0123456789abcdef.far",
+        "vi_itn_verbalizer_0123456789abcdef.far",
+        "vi_itn_lower_cased_fedcba9876543210.far.123.tmp",
+    ]
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+    remove_stale_fars(str(tmp_path / "vi_itn_lower_cased_fedcba9876543210.far"))
+    assert sorted(x.name for x in tmp_path.iterdir()) == sorted(names[1:])
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from src.micro_batcher import MicroBatcher
+from src.result_cache import ResultCache
+from src.worker_pool import PoolFull
+
+
+class Pool:
+    """Stands in for WorkerPool, records the slices each batch is spread into."""
+
+    def __init__(self, workers=2, error=None):
+        self.workers = workers
+        self.error = error
+        self.calls = []
+
+    async def map(self, method, args_list):
+        self.calls.append([texts for (texts,) in args_list])
+        if self.error is not None:
+            raise self.error
+        return [[ValueError(text) if text == "hỏng" else text.upper() for text in texts] for (texts,) in args_list]
+
+
+def submit_all(batcher, texts, delay=0.0):
+    async def submit():
+        futures = []
+        for text in texts:
+            futures.append(asyncio.ensure_future(batcher.submit(text)))
+            await asyncio.sleep(delay)
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    return asyncio.run(submit())
+
+
+def test_batch_is_flushed_when_full():
+    pool = Pool()
+    # the delay is never reached
+    batcher = MicroBatcher(pool, max_size=3, max_delay=60)
+    assert submit_all(batcher, ["a", "b", "c", "d", "e", "f"]) == ["A", "B", "C", "D", "E", "F"]
+    assert pool.calls == [[["a", "b"], ["c"]], [["d", "e"], ["f"]]]
+
+
+def test_batch_is_flushed_after_delay():
+    pool = Pool()
+    batcher = MicroBatcher(pool, max_size=32, max_delay=0.2)
+    # the third text arrives after the first batch was flushed
+    assert submit_all(batcher, ["a", "b", "c"], delay=0.15) == ["A", "B", "C"]
+    assert pool.calls == [[["a"], ["b"]], [["c"]]]
+
+
+def test_batch_is_deduplicated_and_served_from_cache():
+    pool = Pool()
+    cache = ResultCache(4, name="test_batcher_cache")
+    cache.put("ba mươi", "30")
+    batcher = MicroBatcher(pool, max_size=4, max_delay=60, cache=cache)
+    assert submit_all(batcher, ["xin  chào", " xin chào", "ba mươi", "tạm biệt"]) == [
+        "XIN CHÀO",
+        "XIN CHÀO",
+        "30",
+        "TẠM BIỆT",
+    ]
+    assert pool.calls == [[["xin chào"], ["tạm biệt"]]]
+    assert cache.get("tạm biệt") == "TẠM BIỆT"
+
+
+def test_errors_are_raised_to_their_callers():
+    batcher = MicroBatcher(Pool(), max_size=2, max_delay=60)
+    ok, failed = submit_all(batcher, ["một", "hỏng"])
+    assert ok == "MỘT" and isinstance(failed, ValueError)
+    # a batch the pool rejects fails for every caller
+    batcher = MicroBatcher(Pool(error=PoolFull("queue full")), max_size=2, max_delay=60)
+    outputs = submit_all(batcher, ["một", "hai"])
+    assert all(isinstance(output, PoolFull) for output in outputs)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_batch_is_spread_over_workers(workers):
+    pool = Pool(workers=workers)
+    batcher = MicroBatcher(pool, max_size=4, max_delay=60)
+    submit_all(batcher, ["a", "b", "c", "d"])
+    assert len(pool.calls[0]) == workers
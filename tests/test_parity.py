@@ -0,0 +1,78 @@
+import pytest
+
+from src.normalize import InverseTextNormalizer
+
+SENTENCES = [
+    "ngày ba mươi tháng tư năm một chín bảy năm",
+    "xin chào các bạn hôm nay trời đẹp quá",
+    "tổng chi phí là một triệu hai trăm hai mươi hai nghìn đồng",
+    "Anh ta vay năm trăm linh năm triệu không trăm linh năm nghìn không trăm linh năm đồng vào năm một chín chín chín "
+    "và trả dần trong hai mươi lăm năm rưỡi, mỗi tháng hai mươi mốt triệu không trăm linh một nghìn đồng, "
+    "chưa tính lãi một phẩy năm phần trăm mỗi năm.",
+    "kết thúc chuỗi ngày nghỉ lễ (từ ngày ba mươi tháng tư đến ngày bốn tháng năm) giá vàng miếng sjc được niêm yết tại "
+    "một trăm mười chín phẩy ba đến một trăm hai mươi mốt phẩy ba triệu đồng mỗi lượng (mua - bán)",
+    "bây giờ là chín giờ kém hai mươi",
+    "hẹn gặp lúc mười giờ chín phút bốn mươi lăm giây",
+    "gửi mail cho c d f một a còng g mail chấm com nhé",
+    "truy cập h t t p s hai chấm sẹc sẹc w w w chấm google chấm com",
+    "nhiệt độ âm hai mươi độ c",
+    "hai phần ba số người đồng ý",
+    "giá mười hai đô la mỹ và năm mươi xu",
+    "lãi suất không chấm ba lăm phần trăm",
+    "nghị định số tám mươi hai năm hai nghìn mười nđ-cp",
+    "đuôi số điện thoại của tôi là năm tám năm năm",
+]
+
+
+# words made only of punctuation, which the tagger splits into one token per mark
+PUNCTUATION_SENTENCES = [
+    "tôi đi ... rồi về",
+    "tôi đi !! rồi về",
+    "anh -- em",
+    "vui :) lắm",
+    "sao ?, vậy",
+    "có mười người ... rồi về nhà ăn cơm",
+    "một trăm -- hai mươi !! ba mươi ?, xong ...",
+    "...",
+    "... !!",
+    "-- --",
+]
+
+
+def full_pipeline(normalizer, text):
+    # tags and verbalizes the whole sentence, without skipping sentences that have no trigger word
+    return normalizer.invert_text_normalizer.normalize(text)
+
+
+def assert_same_output(normalizer, variant, sentences=SENTENCES):
+    for text in sentences:
+        assert variant.inverse_normalize(text) == full_pipeline(normalizer, text), text
+
+
+def test_trigger_free_sentences_match_full_pipeline(normalizer):
+    assert_same_output(normalizer, normalizer, SENTENCES + PUNCTUATION_SENTENCES)
+
+
+def test_localized_spans_match_full_pipeline(normalizer):
+    assert_same_output(normalizer, InverseTextNormalizer(localize_spans=True), SENTENCES + PUNCTUATION_SENTENCES)
+
+
+@pytest.mark.parametrize("max_chunk_words", [5, 200])
+def test_chunked_matches_full_pipeline(normalizer, max_chunk_words):
+    assert_same_output(normalizer, InverseTextNormalizer(max_chunk_words=max_chunk_words), SENTENCES + PUNCTUATION_SENTENCES)
+
+
+def test_parallel_chunks_match_full_pipeline(normalizer):
+    for text in SENTENCES + PUNCTUATION_SENTENCES:
+        chunked = normalizer.invert_text_normalizer.inverse_normalize_chunked(text, max_words=5, n_jobs=2)
+        assert chunked == full_pipeline(normalizer, text), text
+
+
+def test_native_tokens_match_token_parser(normalizer):
+    assert_same_output(normalizer, InverseTextNormalizer(native_tokens=False))
+
+
+def test_composed_engine_matches_full_pipeline(normalizer):
+    # taggings of equal weight, 2.77 .5 or 2.7 7.5
+    ties = ["hai phẩy bảy bảy chấm năm", "phẩy bảy bảy chấm năm", "bốn hai trăm tôi"]
+    assert_same_output(normalizer, InverseTextNormalizer(engine="composed"), SENTENCES + PUNCTUATION_SENTENCES + ties)
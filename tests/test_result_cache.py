@@ -0,0 +1,98 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import src.normalize
+from src import result_cache
+from src.result_cache import ResultCache
+
+
+def compile_nothing(kwargs):
+    # stands in for compiling the grammars in the child process
+    pass
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    cache = ResultCache(4, ttl=10, name="test_ttl_cache")
+    cache.put("một", "1")
+    now[0] += 10
+    assert cache.get("một") == "1"
+    now[0] += 1
+    assert cache.get("một") is None
+    assert cache.stats()["expirations"] == 1 and cache.stats()["entries"] == 0
+    # recomputed after expiry
+    assert cache.get_or_compute("một", lambda key: "một") == "một"
+
+
+def test_byte_limit_evicts_least_recently_used():
+    # "ba" and "3" take 3 bytes, "mươi" and "10" 8 bytes, "một" and "1" 6 bytes
+    cache = ResultCache(16, max_bytes=12, name="test_bytes_cache")
+    cache.put("ba", "3")
+    cache.put("mươi", "10")
+    assert cache.get("ba") == "3"
+    cache.put("một", "1")
+    assert cache.get("mươi") is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 9, 1)
+    # entries larger than the limit are not stored at all
+    cache.put("một trăm hai mươi", "120")
+    assert cache.get("một trăm hai mươi") is None
+    assert cache.get("ba") == "3" and cache.get("một") == "1"
+
+
+def test_concurrent_misses_are_computed_once():
+    cache = ResultCache(4, name="test_flight_cache")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute(key):
+        calls.append(key)
+        started.set()
+        release.wait()
+        return key.upper()
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(cache.get_or_compute, "xin chào", compute)
+        started.wait()
+        waiters = [executor.submit(cache.get_or_compute, "xin chào", compute) for _ in range(3)]
+        while cache.stats()["coalesced"] < 3:
+            time.sleep(0.001)
+        release.set()
+        assert [f.result() for f in [leader] + waiters] == ["XIN CHÀO"] * 4
+    assert calls == ["xin chào"]
+    assert cache.stats()["misses"] == 1 and cache.stats()["coalesced"] == 3
+
+
+def test_results_computed_before_a_clear_are_not_stored():
+    cache = ResultCache(4, name="test_generation_cache")
+    generation = cache.generation
+    cache.clear()
+    cache.put("một", "1", generation)
+    assert cache.get("một") is None
+    cache.put("một", "1", cache.generation)
+    assert cache.get("một") == "1"
+
+
+def test_reload_drops_results_of_the_old_grammars(normalizer, monkeypatch):
+    monkeypatch.setattr(src.normalize, "_compile_grammars", compile_nothing)
+    monkeypatch.setattr(normalizer, "_load", lambda: normalizer.invert_text_normalizer)
+    monkeypatch.setattr(normalizer, "result_cache", ResultCache(4, name="test_reload_cache"))
+    started, release = threading.Event(), threading.Event()
+
+    def inverse_normalize(text):
+        started.set()
+        release.wait()
+        return "old"
+
+    normalizer.result_cache.put("ba mươi", "30")
+    monkeypatch.setattr(normalizer, "_inverse_normalize", inverse_normalize)
+    with ThreadPoolExecutor(1) as executor:
+        in_flight = executor.submit(normalizer.inverse_normalize, "một trăm")
+        started.wait()
+        normalizer.reload()
+        release.set()
+        assert in_flight.result() == "old"
+    # neither the cached result nor the one finishing during the reload survive it
+    assert normalizer.result_cache.stats()["entries"] == 0
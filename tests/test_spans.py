@@ -0,0 +1,39 @@
+import pytest
+
+SENTENCES = [
+    "ngày ba mươi tháng tư năm một chín bảy năm",
+    "xin chào các bạn hôm nay trời đẹp quá",
+    "tổng chi phí là một triệu hai trăm hai mươi hai nghìn đồng",
+    "kết thúc chuỗi ngày nghỉ lễ (từ ngày ba mươi tháng tư đến ngày bốn tháng năm) giá vàng miếng sjc",
+    "Anh ta vay năm trăm linh năm triệu đồng, chưa tính lãi một phẩy năm phần trăm mỗi năm.",
+    "gửi mail cho c d f một a còng g mail chấm com nhé",
+    "hẹn gặp lúc mười giờ chín phút bốn mươi lăm giây",
+    "có mười người ... rồi về nhà ăn cơm",
+    "tôi đi !! rồi về -- xong",
+    "... !!",
+]
+
+
+@pytest.mark.parametrize("text", SENTENCES)
+def test_tag_spans_cover_every_word(normalizer, text):
+    words = text.split()
+    spans = normalizer.invert_text_normalizer.tag_spans(text)
+    covered = set()
+    for (_, start, end), (_, next_start, next_end) in zip(spans, spans[1:]):
+        assert start <= next_start and end <= next_end
+    for _, start, end in spans:
+        assert 0 <= start < end <= len(words)
+        covered.update(range(start, end))
+    assert covered == set(range(len(words)))
+
+
+@pytest.mark.parametrize("max_words", [200, 4])
+@pytest.mark.parametrize("text", SENTENCES)
+def test_spans_join_to_the_written_form(normalizer, text, max_words):
+    spans = normalizer.invert_text_normalizer.inverse_normalize_spans(text, max_words=max_words)
+    assert " ".join(written for written, _, _ in spans) == normalizer.inverse_normalize(text)
+
+
+def test_words_keep_the_times_of_their_span(normalizer):
+    words = [("ngày", 0.0, 0.4), ("ba", 0.4, 0.6), ("mươi", 0.6, 0.9), ("tháng", 0.9, 1.2), ("tư", 1.2, 1.5)]
+    assert normalizer.inverse_normalize_words(words) == [("ngày", 0.0, 0.4), ("30 tháng 4", 0.4, 1.5)]
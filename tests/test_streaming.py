@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from src.streaming import StreamSession
+
+SEGMENTS = [
+    "hôm nay là ngày ba mươi tháng tư năm một chín bảy năm",
+    "tôi có một trăm",
+    "hai mươi lăm người và giá là một triệu rưỡi",
+    "hẹn gặp lúc mười giờ chín phút",
+]
+
+
+def hypotheses(segment):
+    # growing partial hypotheses, then the final one
+    words = segment.split()
+    return [(" ".join(words[:n]), False) for n in range(1, len(words))] + [(segment, True)]
+
+
+def test_committed_text_matches_whole_text(normalizer):
+    async def normalize(text):
+        return normalizer.inverse_normalize(text)
+
+    async def stream():
+        session = StreamSession(lambda: normalizer.invert_text_normalizer.triggers, normalize)
+        committed = []
+        for segment in SEGMENTS:
+            for text, final in hypotheses(segment):
+                part, _ = await session.update(text, final=final)
+                committed.append(part)
+        part, tail = await session.update("", flush=True)
+        return [part for part in committed + [part] if part], tail
+
+    committed, tail = asyncio.run(stream())
+    # "một trăm" / "hai mươi lăm" across two segments is committed as one number
+    assert tail == ""
+    assert " ".join(committed) == normalizer.inverse_normalize(" ".join(SEGMENTS))
+
+
+@pytest.mark.parametrize("text", [5, None, ["ba", "mươi"]])
+def test_update_rejects_text_that_is_not_a_string(normalizer, text):
+    async def normalize(text):
+        return normalizer.inverse_normalize(text)
+
+    session = StreamSession(lambda: normalizer.invert_text_normalizer.triggers, normalize)
+    with pytest.raises(ValueError):
+        asyncio.run(session.update(text))
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from src.subtitles import SubtitleNormalizer, find_subtitles
+
+
+@pytest.mark.parametrize(
+    "text, expected, joined",
+    [
+        # the start of the next cue joins the previous one
+        (
+            "1\n00:00:01,000 --> 00:00:02,000\ncó một trăm\n\n2\n00:00:02,000 --> 00:00:03,000\nhai mươi người\n\n",
+            "1\n00:00:01,000 --> 00:00:02,000\ncó 120\n\n2\n00:00:02,000 --> 00:00:03,000\nngười\n\n",
+            1,
+        ),
+        # lines of one cue are joined when the phrase is all of both
+        (
+            "1\n00:00:01,000 --> 00:00:02,000\nmột trăm\nhai mươi\n\n",
+            "1\n00:00:01,000 --> 00:00:02,000\n120\n\n",
+            1,
+        ),
+        # cues are never left without text
+        (
+            "1\n00:00:01,000 --> 00:00:02,000\nmột trăm\n\n2\n00:00:02,000 --> 00:00:03,000\nhai mươi\n\n",
+            "1\n00:00:01,000 --> 00:00:02,000\n100\n\n2\n00:00:02,000 --> 00:00:03,000\n20\n\n",
+            0,
+        ),
+        # lines with markup are not joined
+        (
+            "1\n00:00:01,000 --> 00:00:02,000\n<i>một trăm</i>\nhai mươi người\n\n",
+            "1\n00:00:01,000 --> 00:00:02,000\n<i>100</i>\n20 người\n\n",
+            0,
+        ),
+        # headers, cue settings and line endings are kept
+        (
+            "WEBVTT\r\n\r\n00:01.000 --> 00:02.000 align:start\r\nmột trăm\r\nhai mươi người\r\n\r\n",
+            "WEBVTT\r\n\r\n00:01.000 --> 00:02.000 align:start\r\n120\r\nngười\r\n\r\n",
+            1,
+        ),
+    ],
+)
+def test_phrase_straddling_a_break(normalizer, tmp_path, text, expected, joined):
+    input_path, output_path = tmp_path / "in.srt", tmp_path / "out.srt"
+    input_path.write_bytes(text.encode())
+    # a window of one cue flushes between the cues of a phrase
+    stats = SubtitleNormalizer(normalizer, window=1).normalize_file(str(input_path), str(output_path))
+    assert output_path.read_bytes().decode() == expected
+    assert stats["joined"] == joined
+    assert stats["errors"] == 0
+
+
+def test_find_subtitles_skips_outputs(tmp_path):
+    for name in ["a.srt", "a.itn.srt", "b.vtt", "notes.txt", "out/a.srt", "nested/c.srt", "nested/c.itn.srt"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text("")
+    files = find_subtitles([str(tmp_path)], exclude=str(tmp_path / "out"))
+    assert sorted(os.path.relpath(path, tmp_path) for path in files) == ["a.srt", "b.vtt", "nested/c.srt"]
+    # files given by name are kept
+    assert find_subtitles([str(tmp_path / "a.itn.srt")]) == [str(tmp_path / "a.itn.srt")]
@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from src.metrics import metrics
+from src.micro_batcher import MicroBatcher
+from src.normalize import InverseTextNormalizer
+from src.worker_pool import WorkerPool
+
+
+def test_process_pool_reports_worker_metrics(api):
+    assert api.pool.kind == "process"
+    with TestClient(api.app) as client:
+        for _ in range(2):
+            assert client.post("/normalize", json={"text": "một trăm hai mươi"}).json() == {"normalized_text": "120"}
+        assert client.post("/normalize/batch", json={"texts": ["một trăm hai mươi", "ba mươi"]}).status_code == 200
+        rendered = client.get("/metrics").text
+    for name in [
+        "viet_itn_result_cache_hits_total",
+        "viet_itn_result_cache_misses_total",
+        "viet_itn_token_cache_misses_total",
+        "viet_itn_order_preserved_total",
+    ]:
+        assert f"\n{name} " in rendered
+    # the second /normalize and the repeated batch text are served by the cache of the server process
+    assert "\nviet_itn_result_cache_hits_total 2\n" in rendered
+
+
+def test_process_pool_reports_composed_metrics():
+    pool = WorkerPool(InverseTextNormalizer(engine="composed"), kind="process")
+    try:
+        assert asyncio.run(pool.run("inverse_normalize", "một trăm")) == "100"
+    finally:
+        pool.shutdown()
+    assert "\nviet_itn_composed_total " in metrics.render()
+
+
+def test_process_pool_raises_worker_errors():
+    pool = WorkerPool(InverseTextNormalizer(), kind="process")
+    try:
+        with pytest.raises(TypeError):
+            asyncio.run(pool.run("inverse_normalize", None))
+    finally:
+        pool.shutdown()
+
+
+def test_concurrent_identical_requests_are_computed_once(api, monkeypatch):
+    calls = []
+
+    async def pool_map(method, args_list):
+        calls.append([args[0] for args in args_list])
+        await asyncio.sleep(0.1)
+        return [[text.upper() for text in texts] for (texts,) in args_list]
+
+    monkeypatch.setattr(api.pool, "map", pool_map)
+    api.parent_cache.clear()
+
+    async def requests():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            single = [client.post("/normalize", json={"text": "  xin   chào"}) for _ in range(5)]
+            batch = client.post("/normalize/batch", json={"texts": ["xin chào", "tạm biệt"]})
+            return await asyncio.gather(*single, batch)
+
+    *single, batch = asyncio.run(requests())
+    assert all(response.json() == {"normalized_text": "XIN CHÀO"} for response in single)
+    assert [item["normalized_text"] for item in batch.json()["results"]] == ["XIN CHÀO", "TẠM BIỆT"]
+    # one call for "xin chào", the batch only normalizes "tạm biệt"
+    assert calls == [[["xin chào"]], [["tạm biệt"]]]
+    assert not api.in_flight
+
+
+def test_microbatcher_shares_the_server_cache(api, monkeypatch):
+    calls = []
+
+    async def pool_map(method, args_list):
+        calls.append([args[0] for args in args_list])
+        return [[text.upper() for text in texts] for (texts,) in args_list]
+
+    monkeypatch.setattr(api.pool, "map", pool_map)
+    api.parent_cache.clear()
+
+    async def normalize():
+        batcher = MicroBatcher(api.pool, max_size=2, max_delay=0.01, cache=api.parent_cache)
+        first = await api.normalize_text("xin chào")
+        return [first] + await asyncio.gather(batcher.submit("xin  chào"), batcher.submit("tạm biệt"))
+
+    assert asyncio.run(normalize()) == ["XIN CHÀO", "XIN CHÀO", "TẠM BIỆT"]
+    # the batch only normalizes the text /normalize did not
+    assert calls == [[["xin chào"]], [["tạm biệt"]]]
+    assert api.parent_cache.get("tạm biệt") == "TẠM BIỆT"